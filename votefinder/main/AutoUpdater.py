@@ -0,0 +1,180 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import close_old_connections
+from django.db.models import F, Max
+
+from votefinder.main import views
+from votefinder.main.models import Game, UpdaterLease, UpdaterNode
+
+import logging
+logger = logging.getLogger(__name__)
+
+# a game whose deadline is this close (either side) is checked as often as a busy one
+DEADLINE_WINDOW = timedelta(hours=1)
+
+
+class SweepStats:
+    def __init__(self, started, running):
+        self.started = started
+        self.running = running
+        self.finished = 0
+        self.failed = 0
+        self.durations = []
+
+    def add(self, seconds, failed):
+        self.finished += 1
+        self.failed += int(failed)
+        self.durations.append(seconds)
+
+    def __str__(self):
+        timing = ''
+        if self.durations:
+            timing = f', {sum(self.durations) / len(self.durations):.2f}s average, {max(self.durations):.2f}s slowest'
+        return (f'{self.started} started, {self.finished} finished ({self.failed} failed){timing}, '
+                f'{self.running} still running')
+
+
+class NodeLeases:
+    # Shares the open games out between autoupdated nodes through UpdaterLease rows. On every sweep a node
+    # renews its own leases (its heartbeat), gives back any beyond its fair share of the games, and claims
+    # expired ones up to that share, at most batch_size at a time. Each claim is a conditional UPDATE, so
+    # two nodes can never both win the same game; a node that stops is taken over once its leases expire.
+    def __init__(self, name, lease_seconds, batch_size):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        # not update_or_create: its read-then-write transaction fails outright on a busy SQLite database
+        UpdaterNode.objects.bulk_create([UpdaterNode(name=name)], ignore_conflicts=True)
+        self.node = UpdaterNode.objects.get(name=name)
+
+    def claim(self, open_ids, busy_ids):
+        # returns the ids of the open games this node should look after
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        UpdaterNode.objects.filter(id=self.node.id).update(heartbeat_at=now)
+        UpdaterLease.objects.filter(node=self.name).update(expires_at=expires_at)
+
+        UpdaterLease.objects.exclude(game_id__in=open_ids).delete()
+        unleased = open_ids - set(UpdaterLease.objects.values_list('game_id', flat=True))
+        UpdaterLease.objects.bulk_create([UpdaterLease(game_id=game_id, expires_at=now) for game_id in unleased],
+                                         ignore_conflicts=True)
+
+        nodes = UpdaterNode.objects.filter(heartbeat_at__gte=now - timedelta(seconds=self.lease_seconds)).count()
+        share = math.ceil(len(open_ids) / max(nodes, 1))
+        held = set(UpdaterLease.objects.filter(node=self.name).values_list('game_id', flat=True))
+
+        surplus = sorted(held - busy_ids, reverse=True)[:max(len(held) - share, 0)]
+        if surplus:
+            UpdaterLease.objects.filter(node=self.name, game_id__in=surplus).update(node='', expires_at=now)
+            held.difference_update(surplus)
+
+        wanted = min(share - len(held), self.batch_size)
+        if wanted > 0:
+            expired = UpdaterLease.objects.filter(expires_at__lt=now).order_by('game_id')
+            for game_id in expired.values_list('game_id', flat=True)[:wanted]:
+                claimed = UpdaterLease.objects.filter(game_id=game_id, expires_at__lt=now).update(
+                    node=self.name, expires_at=expires_at)
+                if claimed:  # otherwise another node got there first
+                    held.add(game_id)
+        return held
+
+    def record(self, stats):
+        if stats.finished:
+            UpdaterNode.objects.filter(id=self.node.id).update(
+                games_updated=F('games_updated') + stats.finished - stats.failed,
+                updates_failed=F('updates_failed') + stats.failed,
+                update_seconds=F('update_seconds') + sum(stats.durations))
+
+    def release(self):
+        UpdaterLease.objects.filter(node=self.name).update(node='', expires_at=datetime.now())
+        UpdaterNode.objects.filter(id=self.node.id).update(heartbeat_at=None)
+
+
+class AutoUpdater:
+    # Keeps every open game up to date, each on its own schedule. A game is checked again after
+    # a tenth of the time since its last post, between min_seconds and max_seconds, so busy games
+    # are followed closely and quiet ones back off; a game near its deadline always gets min_seconds.
+    # Updates run on a pool of workers, and a game that's still being updated is never started again,
+    # so one slow forum page only ever ties up one worker.
+    def __init__(self, workers, min_seconds, max_seconds, prerender_images=None, leases=None, clock=time.monotonic):
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.clock = clock
+        self.leases = leases  # NodeLeases, when sharing the games with other nodes
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.due = {}  # game id -> clock time its next update is due
+        self.running = {}  # game id -> (future, clock time it was started)
+        if prerender_images is None:
+            # images drawn into a cache of our own would never be seen by the web workers
+            prerender_images = not isinstance(caches['default'], LocMemCache)
+        self.prerender_images = prerender_images
+
+    def sweep(self):
+        # starts every game that's due and collects the updates that have finished since the last sweep
+        stats = SweepStats(0, 0)
+        now = self.clock()
+        for game_id, (update, started) in list(self.running.items()):
+            if not update.done():
+                continue
+            del self.running[game_id]
+            if update.exception() is None:
+                interval, seconds = update.result()
+                stats.add(seconds, failed=False)
+            else:
+                interval = self.min_seconds  # try again soon
+                stats.add(now - started, failed=True)
+            self.due[game_id] = now + interval
+
+        open_ids = set(Game.objects.exclude(state='closed').values_list('id', flat=True))
+        if self.leases is not None:
+            open_ids = self.leases.claim(open_ids, set(self.running))
+            self.leases.record(stats)
+        self.due = {game_id: due for game_id, due in self.due.items() if game_id in open_ids}
+        for game_id in open_ids - self.running.keys():
+            if self.due.get(game_id, now) <= now:
+                self.running[game_id] = (self.executor.submit(self.update_game, game_id), now)
+                stats.started += 1
+
+        stats.running = len(self.running)
+        return stats
+
+    def wait(self):
+        for update, _ in list(self.running.values()):
+            update.exception()
+
+    def shutdown(self):
+        for update, _ in self.running.values():
+            update.cancel()  # anything still waiting for a worker
+        self.executor.shutdown(wait=True)
+        if self.leases is not None:
+            self.leases.release()
+
+    def update_game(self, game_id):
+        # runs on a worker; returns how long to wait before checking this game again, and how long this update took
+        started = time.perf_counter()
+        try:
+            game = views.update_open_game(Game.objects.get(id=game_id))
+            if self.prerender_images:
+                render = views.prerender_votecount_image(game)
+                if render is not None:
+                    views.store_prerendered_image(game, render)
+            last_post = game.posts.aggregate(last_post=Max('timestamp'))['last_post']
+            return self.interval(game, last_post, datetime.now()), time.perf_counter() - started
+        except Exception:
+            logger.exception(f'Could not update game {game_id}')
+            raise
+        finally:
+            close_old_connections()
+
+    def interval(self, game, last_post, now):
+        if game.deadline and abs(game.deadline - now) < DEADLINE_WINDOW:
+            return self.min_seconds
+        if last_post is None:
+            return self.max_seconds
+        quiet_seconds = (now - last_post).total_seconds()
+        return min(max(quiet_seconds / 10, self.min_seconds), self.max_seconds)
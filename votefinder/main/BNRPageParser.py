@@ -1,16 +1,20 @@
+import hashlib
+import json
 import re
 import bbcode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from bs4 import BeautifulSoup
-from votefinder.main.models import (Game, GameDay, Player, PlayerState,
+from django.conf import settings
+from votefinder.main.models import (Game, GameDay, PlayerState,
                                     Post)
 
-from votefinder.main import BNRApi, PostParser
+from votefinder.main import BNRApi, PageArchive, PostBodySerializer, PostIngester, PostParser, VoteResolver
 
 
 class BNRPageParser:
-    def __init__(self):
+    def __init__(self, offline=False):
         self.pageNumber = 0
         self.maxPages = 0
         self.gameName = ''
@@ -19,7 +23,8 @@ class BNRPageParser:
         self.gamePlayers = []
         self.votes = []
         self.user = None
-        self.api = BNRApi.BNRApi()
+        # offline parsers only ever read pages they're given, such as ones from the page archive
+        self.api = None if offline else BNRApi.BNRApi()
 
     def add_game(self, threadid, state):
         self.new_game = True
@@ -41,26 +46,72 @@ class BNRPageParser:
         if game.current_page < game.max_pages:
             page = game.current_page + 1
 
-        return self.download_and_update(game.thread_id, page)
+        thread = self.api.get_thread(game.thread_id, page)
+        if game.page_fingerprint and self.page_fingerprint(thread) == game.page_fingerprint:
+            return game  # the same posts as last time, so there's nothing to parse
+
+        return self.parse_page(thread, game.thread_id)
+
+    def catch_up(self, game, progress=None, lease=None):
+        # Reads the next page the same way update does, which tells us how many pages the thread
+        # really has, then downloads the rest of the missing pages concurrently and ingests them in order
+        new_game = self.update(game)
+        if not new_game:
+            return None
+        game = new_game
+
+        last_page = min(game.max_pages, game.current_page + settings.VF_CATCHUP_MAX_PAGES)
+        pages = range(game.current_page + 1, last_page + 1)
+        if progress:
+            progress(game.current_page, game.max_pages)
+        if not pages:
+            return game
+
+        with ThreadPoolExecutor(max_workers=settings.VF_CATCHUP_WORKERS) as pool:
+            downloads = [pool.submit(self.api.get_thread, game.thread_id, page) for page in pages]
+            for download in downloads:
+                if lease is not None and not game.renew_lease(lease):
+                    break  # our lease ran out and someone else is updating the game now
+                try:
+                    new_game = self.parse_page(download.result(), game.thread_id)
+                except (KeyError, ValueError):
+                    new_game = None
+                if not new_game:
+                    break
+                game = new_game
+                if progress:
+                    progress(game.current_page, game.max_pages)
+            for pending in downloads:
+                pending.cancel()  # anything left after stopping early
+
+        return game
 
     def parse_page(self, thread, threadid):
+        self.posts = []
         self.pageNumber = thread['pagination']['current_page']
         self.maxPages = thread['pagination']['last_page']
         self.gameName = re.compile(r'\[.*?\]').sub('', thread['thread']['title']).strip()
 
+        if PageArchive.page_archive is not None:
+            PageArchive.page_archive.store('bnr', threadid, self.pageNumber, json.dumps(thread))
+
         posts = thread['posts']
         if not posts:
             return None
 
-        mod = None
+        known_posts = self.find_known_posts(posts)
         for post_node in posts:
-            new_post = self.read_post_values(post_node)  # TODO
-            if new_post:
-                if not mod:
-                    mod = new_post.author
+            if post_node['post_id'] not in known_posts:
+                new_post = self.read_post_values(post_node)
+                if new_post:
+                    new_post.page_number = self.pageNumber
+                    self.posts.append(new_post)
+
+        authors = self.find_or_create_players({post.author_uid: post.author_name for post in self.posts})
+        for post in self.posts:
+            post.author = authors[post.author_uid]
+        mod = self.posts[0].author if self.posts else None
 
-                new_post.page_number = self.pageNumber
-                self.posts.append(new_post)
         if self.new_game and self.state == 'pregame':
             day_number = 0
         else:
@@ -84,55 +135,70 @@ class BNRPageParser:
         game.max_pages = self.maxPages
         game.current_page = self.pageNumber
         game.name = self.gameName
-        post_parser = PostParser.PostParser()
+        game.page_fingerprint = self.page_fingerprint(thread)
+        ingester = PostIngester.PostIngester(game)
+        ingester.store_posts(self.posts)
+        resolver = VoteResolver.VoteResolver(game, self.gamePlayers)
+        resolver.load_players([post.author for post in self.posts])
+        for player in self.players:
+            resolver.add_poster(player)
+        post_parser = PostParser.PostParser(resolver)
         for post in self.posts:
-            post.game = game
-            post.save()
-            post_parser.read_votes(post, self.gamePlayers, self.players)
+            post_parser.read_votes(post)
             if post.author not in self.players:
                 self.players.append(post.author)
-            cur_player = post.author
-            cur_player.last_post = datetime.now()
-            cur_player.total_posts += 1
-            cur_player.save()
+            resolver.add_poster(post.author)
+        ingester.store_votes(post_parser.votes)
+        ingester.count_posts(self.posts)
 
         if self.new_game or game.state == 'pregame':
             default_state = 'alive'
         else:
             default_state = 'spectator'
 
-        for player in self.players:
-            player_state, created = PlayerState.objects.get_or_create(game=game, player=player,
-                                                                      defaults={default_state: True})
+        ingester.add_to_roster(self.players, default_state)
 
         if game_created:
             gameday = GameDay(game=game, day_number=day_number, start_post=self.posts[0])
             gameday.save()
 
-        game.save()
+        game.save()  # bumps the version itself if the game has moved on in the thread
+        if self.posts:
+            game.bump_version()
         return game
 
-    def find_or_create_player(self, playername, playeruid):
-        player, created = Player.objects.get_or_create(bnr_uid=playeruid,
-                                                       defaults={'name': playername})
+    def find_or_create_players(self, names_by_uid):
+        return PostIngester.find_or_create_players('bnr_uid', names_by_uid)
 
-        if player.name != playername:
-            player.name = playername
-            player.save()
+    def read_archived_page(self, content):
+        # every post on a page from the page archive, read the same way parse_page reads new ones
+        thread = json.loads(content)
+        posts = [post for post in map(self.read_post_values, thread['posts']) if post]
+        for post in posts:
+            post.page_number = thread['pagination']['current_page']
+        return posts
 
-        return player
+    def page_fingerprint(self, thread):
+        # the posts on the page and the thread's page count, before any of it is turned into models
+        try:
+            post_ids = [post['post_id'] for post in thread['posts']]
+            pagination = thread['pagination']
+        except (KeyError, TypeError):
+            return ''
+        if not post_ids:
+            return ''
+        return hashlib.sha1(f'{post_ids}{pagination}'.encode()).hexdigest()  # noqa: S324
+
+    def find_known_posts(self, nodes):
+        post_ids = [node['post_id'] for node in nodes]
+        return set(Post.objects.filter(post_id__in=post_ids, game__home_forum='bnr').values_list('post_id', flat=True))
 
     def read_post_values(self, node):
         post_id = node['post_id']
         if post_id == '':
             return None
 
-        try:
-            post = Post.objects.get(post_id=post_id, game__home_forum='bnr')
-            return None
-        except Post.DoesNotExist:
-            post = Post()
-
+        post = Post()
         post.post_id = post_id
         post.avatar = node['User']['avatar_urls']['o']
 
@@ -144,15 +210,13 @@ class BNRPageParser:
         for quote in post.bodySoup.findAll('blockquote'):
             quote.name = 'div'
             quote['class'] = 'quote well'
-        [img.replaceWith(f'<div class="embedded-image not-loaded" data-image="{img["src"]}">Click to load image...</div>') for img in post.bodySoup.find_all('img')]  # noqa: WPS428 false positive
-        post.body = post.bodySoup.prettify(formatter=None)
+        post.body = PostBodySerializer.PostBodySerializer().serialize(post.bodySoup)
         post.timestamp = datetime.fromtimestamp(node['post_date'])
 
         author_string = node['User']['username']
         author_string = re.sub(r'<.*?>', '', author_string)
         author_string = re.sub(r'&\w+?;', '', author_string).strip()
-        author_uid = node['User']['user_id']
-
-        post.author = self.find_or_create_player(author_string, author_uid)
+        post.author_uid = node['User']['user_id']
+        post.author_name = author_string
 
         return post
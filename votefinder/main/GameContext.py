@@ -0,0 +1,116 @@
+import math
+from functools import cached_property
+
+from django.core.cache import cache
+from django.utils.text import slugify
+
+from votefinder.main import VoteCounter, VotecountFormatter
+
+# derived data is keyed on Game.version, so it never goes stale - this only bounds how long it's kept
+GAME_CACHE_SECONDS = 60 * 60 * 24
+
+
+class GameContext:
+    # Everything a single request needs to know about one game, worked out at most once.
+    # The roster is read in one query and split up in memory, and the vote tally and
+    # votecount are only computed the first time something asks for them.
+    # The votecount, its BBCode and the vote log are also shared between requests through the
+    # cache until the game's version changes, so most requests never count votes at all.
+    def __init__(self, game, request=None):
+        self.game = game
+        self.request = request
+
+    @cached_property
+    def player_states(self):
+        return sorted(self.game.players.select_related('player'), key=lambda player: player.player.name.lower())
+
+    @cached_property
+    def living_players(self):
+        return [player for player in self.player_states if player.alive]
+
+    @cached_property
+    def dead_players(self):
+        return [player for player in self.player_states
+                if not player.alive and not player.moderator and not player.spectator]
+
+    @cached_property
+    def spectators(self):
+        return [player for player in self.player_states if player.spectator]
+
+    @cached_property
+    def moderators(self):
+        return [player for player in self.player_states if player.moderator]
+
+    @cached_property
+    def gameday(self):
+        return self.game.days.select_related().last()
+
+    @cached_property
+    def to_execute(self):
+        return int(math.floor(len(self.living_players) / 2.0) + 1)
+
+    @cached_property
+    def is_moderator(self):
+        user = getattr(self.request, 'user', None)
+        if user is None:
+            return False
+        if user.is_superuser:
+            return True
+        if not user.is_authenticated:
+            return False
+        try:
+            player_id = user.profile.player_id
+        except AttributeError:
+            return False
+        return any(state.player_id == player_id for state in self.moderators)
+
+    @cached_property
+    def vote_counter(self):
+        vote_counter = VoteCounter.VoteCounter()
+        vote_counter.run(self.game, context=self)
+        return vote_counter
+
+    @cached_property
+    def counted_votes(self):
+        return self.vote_counter.build_result_list()
+
+    @cached_property
+    def formatter(self):
+        vc_formatter = VotecountFormatter.VotecountFormatter(self.game, context=self)
+        vc_formatter.go()
+        return vc_formatter
+
+    @cached_property
+    def game_state(self):
+        key = self.game.cache_key('game-state')
+        game_state = cache.get(key)
+        if game_state is None:
+            game_state = self.formatter.game_state
+            cache.set(key, game_state, GAME_CACHE_SECONDS)
+        # the countdown to the deadline moves on even when the game doesn't
+        return {**game_state, **VotecountFormatter.deadline_fields(self.game)}
+
+    @cached_property
+    def bbcode(self):
+        key = self.game.cache_key(f'bbcode-{slugify(self.game_state["until_deadline"])}')
+        bbcode = cache.get(key)
+        if bbcode is None:
+            vc_formatter = VotecountFormatter.VotecountFormatter(self.game, context=self)
+            vc_formatter.show(self.game_state)
+            bbcode = vc_formatter.get_bbcode()
+            cache.set(key, bbcode, GAME_CACHE_SECONDS)
+        return bbcode
+
+    @cached_property
+    def escaped_bbcode(self):
+        # the cached BBCode is escaped as it is, so a cache hit still counts no votes
+        return VotecountFormatter.VotecountFormatter(self.game, context=self).escape_bbcode(self.bbcode)
+
+    @cached_property
+    def votelog(self):
+        key = self.game.cache_key('votelog')
+        votelog = cache.get(key)
+        if votelog is None:
+            votelog = self.vote_counter.get_votelog()
+            cache.set(key, votelog, GAME_CACHE_SECONDS)
+        return votelog
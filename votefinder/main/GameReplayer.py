@@ -0,0 +1,103 @@
+from itertools import groupby
+
+from django.db import close_old_connections, transaction
+from votefinder.main.models import Game, Post, Vote
+
+from votefinder.main import BNRPageParser, PageArchive, PostIngester, PostParser, SAPageParser, VoteResolver
+
+PAGE_PARSERS = {'sa': SAPageParser.SAPageParser, 'bnr': BNRPageParser.BNRPageParser}
+# everything about a post that comes from reading its page
+REREAD_FIELDS = ['timestamp', 'author', 'author_search', 'body', 'avatar', 'page_number']
+
+
+class GameReplayer:
+    # Rebuilds a game's posts and forum votes from its pages in the page archive, for when the parser or the
+    # vote rules have changed, without downloading anything. Stored posts are updated in place, keeping their
+    # ids, so game days and manual votes stay attached to them; posts missing from the database are added.
+    # The forum votes on every archived page are then read again from scratch in post order, and the ones
+    # a moderator had ignored stay ignored. Pages that aren't in the archive are left as they are.
+    def __init__(self, game, archive):
+        self.game = game
+        self.archive = archive
+        self.parser = PAGE_PARSERS[game.home_forum](offline=True)
+
+    def read_posts(self):
+        pages = self.archive.pages(self.game.home_forum, self.game.thread_id)
+        posts = {}
+        for _, path in pages:
+            for post in self.parser.read_archived_page(self.archive.read(path)):
+                posts[post.post_id] = post
+        return [page for page, _ in pages], sorted(posts.values(), key=lambda post: post.post_id)
+
+    def run(self):
+        # returns how many pages, posts, new posts and votes were read
+        pages, posts = self.read_posts()
+        if not posts:
+            return len(pages), 0, 0, 0
+
+        with transaction.atomic():
+            archived = self.game.posts_archived
+            if archived:
+                self.game.restore_post_bodies()
+            new_posts = self.store_posts(posts)
+            votes = self.store_votes(pages, posts)
+            self.game.invalidate_tally()
+            if archived:
+                self.game.archive_post_bodies()
+
+        return len(pages), len(posts), len(new_posts), len(votes)
+
+    def store_posts(self, posts):
+        authors = self.parser.find_or_create_players({post.author_uid: post.author_name for post in posts})
+        stored_ids = dict(self.game.posts.values_list('post_id', 'id'))
+        new_posts = []
+        for post in posts:
+            post.author = authors[post.author_uid]
+            post.game = self.game
+            post.id = stored_ids.get(post.post_id)
+            if post.id is None:
+                new_posts.append(post)
+        Post.objects.bulk_update([post for post in posts if post.id is not None], REREAD_FIELDS, batch_size=500)
+
+        ingester = PostIngester.PostIngester(self.game)
+        ingester.store_posts(new_posts)
+        ingester.count_posts(new_posts)
+        ingester.add_to_roster(list(authors.values()), 'alive' if self.game.state == 'pregame' else 'spectator')
+        return new_posts
+
+    def store_votes(self, pages, posts):
+        forum_votes = Vote.objects.filter(game=self.game, manual=False, post__page_number__in=pages)
+        ignored = set(forum_votes.filter(ignored=True).values_list('post__post_id', 'target_string'))
+        forum_votes.delete()
+
+        # a moderator's ##deadline is read again too, but it mustn't undo any deadline set since
+        deadline = self.game.deadline
+        game_players = [state.player for state in self.game.all_players()]
+        ingester = PostIngester.PostIngester(self.game)
+        votes = []
+        for _, page_posts in groupby(posts, key=lambda post: post.page_number):
+            # each page gets its own resolver and parser, and its votes are stored before the next page is read,
+            # just as when the pages were first read
+            page_posts = list(page_posts)
+            resolver = VoteResolver.VoteResolver(self.game, game_players)
+            resolver.load_players([post.author for post in page_posts])
+            post_parser = PostParser.PostParser(resolver)
+            for post in page_posts:
+                post_parser.read_votes(post)
+                resolver.add_poster(post.author)
+            for vote in post_parser.votes:
+                vote.ignored = (vote.post.post_id, vote.target_string) in ignored
+            ingester.store_votes(post_parser.votes)
+            votes.extend(post_parser.votes)
+
+        Game.objects.filter(id=self.game.id).update(deadline=deadline)
+        self.game.deadline = deadline
+        return votes
+
+
+def replay_game(game_id):
+    # runs in one of replay_archived_pages' worker processes
+    try:
+        return GameReplayer(Game.objects.get(id=game_id), PageArchive.page_archive).run()
+    finally:
+        close_old_connections()
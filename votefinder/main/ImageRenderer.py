@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent import futures
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+
+from votefinder.main.votecount_image_generation import render_game_state
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ImageRendererBusy(Exception):
+    def __init__(self):
+        self.message = 'Too many votecount images are waiting to be drawn.'
+
+    def __str__(self):
+        return self.message
+
+
+class ImageRenderer:
+    # Draws votecount images from game_state dicts in a small pool of worker processes, so
+    # Pillow doesn't hold the GIL in Django's workers and a slow render can't tie up a request.
+    # At most workers + queue_size renders are accepted at once; beyond that submit() raises
+    # ImageRendererBusy (or waits for room, if asked to). With VF_IMAGE_RENDER_WORKERS = 0
+    # images are drawn in the calling thread instead, as SVGs always are, since they are only text.
+    # The worker processes are started with the python interpreter given, since under uwsgi sys.executable
+    # is uwsgi itself; if there's no interpreter to start them with, images are drawn in the calling thread.
+    def __init__(self, workers, queue_size, timeout, python=None):
+        python = python or sys.executable
+        if workers and not os.path.basename(python).lower().startswith('python'):
+            logger.warning(f'{python} is not a python interpreter, so votecount images are drawn in-process; '
+                           'set VF_IMAGE_RENDER_PYTHON to draw them in worker processes')
+            workers = 0
+        self.workers = workers
+        self.python = python
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def get_pool(self):
+        # started on first use so that importing views doesn't spawn processes
+        with self.pool_lock:
+            if self.pool is None:
+                context = multiprocessing.get_context('spawn')
+                context.set_executable(self.python)
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                initializer=django.setup)
+            return self.pool
+
+    def reset_pool(self, pool):
+        with self.pool_lock:
+            if self.pool is pool:
+                self.pool = None
+        # a broken pool has already failed everything it was given, so there's nothing left to cancel
+        pool.shutdown(wait=False)
+
+    def submit(self, game_state, image_format='png', wait=False):
+        if not self.workers or image_format == 'svg':
+            render = Future()
+            render.set_result(render_game_state(game_state, image_format))
+            return render
+
+        if not self.slots.acquire(blocking=wait, timeout=self.timeout if wait else None):
+            raise ImageRendererBusy
+        try:
+            render = self.submit_to_pool(game_state, image_format)
+        except BaseException:
+            self.slots.release()
+            raise
+        render.add_done_callback(lambda _: self.slots.release())
+        return render
+
+    def submit_to_pool(self, game_state, image_format):
+        pool = self.get_pool()
+        try:
+            return pool.submit(render_game_state, game_state, image_format)
+        except BrokenProcessPool:
+            # a worker died; start over with a fresh pool
+            self.reset_pool(pool)
+            return self.get_pool().submit(render_game_state, game_state, image_format)
+
+    def render(self, game_state, image_format='png'):
+        # the image file for game_state; raises ImageRendererBusy or futures.TimeoutError rather than waiting forever
+        render = self.submit(game_state, image_format)
+        try:
+            return render.result(timeout=self.timeout)
+        except futures.TimeoutError:
+            render.cancel()
+            raise
+
+
+image_renderer = ImageRenderer(settings.VF_IMAGE_RENDER_WORKERS, settings.VF_IMAGE_RENDER_QUEUE,
+                               settings.VF_IMAGE_RENDER_TIMEOUT, settings.VF_IMAGE_RENDER_PYTHON)
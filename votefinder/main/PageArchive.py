@@ -0,0 +1,55 @@
+import gzip
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class PageArchive:
+    # Keeps the raw forum pages votefinder has read, so games can be read again later without going back to the
+    # forums. Each page is gzipped at <directory>/<forum>/<thread id>/<page>.<hash of its content>.gz; only the
+    # latest copy of a page is kept, and storing a page that hasn't changed since its last copy writes nothing.
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def thread_directory(self, forum, thread_id):
+        return self.directory / forum / str(thread_id)
+
+    def store(self, forum, thread_id, page, content):
+        # an archive that can't be written to never stops an update
+        try:
+            self.write(self.thread_directory(forum, thread_id), page, content.encode())
+        except OSError:
+            logger.exception(f'Could not archive page {page} of {forum} thread {thread_id}')
+
+    def write(self, directory, page, content):
+        path = directory / f'{page}.{hashlib.sha1(content).hexdigest()}.gz'  # noqa: S324
+        if path.exists():
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as temp_file:
+            temp_file.write(gzip.compress(content))
+        os.replace(temp_file.name, path)
+        for old_copy in directory.glob(f'{page}.*.gz'):
+            if old_copy != path:
+                old_copy.unlink(missing_ok=True)
+
+    def pages(self, forum, thread_id):
+        # (page number, path) for every archived page of a thread, in order
+        latest = {}
+        for path in self.thread_directory(forum, thread_id).glob('*.gz'):
+            page = int(path.name.split('.', 1)[0])
+            if page not in latest or path.stat().st_mtime > latest[page].stat().st_mtime:
+                latest[page] = path
+        return sorted(latest.items())
+
+    def read(self, path):
+        return gzip.decompress(path.read_bytes()).decode()
+
+
+page_archive = PageArchive(settings.VF_PAGE_ARCHIVE_DIR) if settings.VF_PAGE_ARCHIVE_DIR else None
@@ -0,0 +1,65 @@
+import re
+from html import escape
+
+from bs4.element import PreformattedString, Tag
+
+# tags written without a closing tag
+VOID_TAGS = frozenset(('area', 'br', 'col', 'embed', 'hr', 'img', 'input', 'source', 'track', 'wbr'))
+# tags left out of a post body along with everything inside them
+DROPPED_TAGS = frozenset(('head', 'link', 'meta', 'script', 'style', 'title'))
+# tags whose whitespace is kept as it is
+PREFORMATTED_TAGS = frozenset(('pre', 'textarea'))
+URL_ATTRIBUTES = frozenset(('action', 'href', 'src'))
+WHITESPACE_PATTERN = re.compile(r'\s+')
+IMAGE_PLACEHOLDER = '<div class="embedded-image not-loaded" data-image="{}">Click to load image...</div>'
+
+
+class PostBodySerializer:
+    # Writes out the HTML inside a post's body as compactly as it renders, in one walk over the tree.
+    # Text and attribute values are escaped, and runs of whitespace outside <pre> become a single space.
+    # Comments (including SA's google_ad_section markers), scripts, styles, event handler attributes
+    # and javascript: links are left out, and images become the click-to-load placeholders game.html expects.
+    def serialize(self, node):
+        parts = []
+        for child in node.contents:
+            self.write(child, parts, preformatted=False)
+        return ''.join(parts).strip()
+
+    def write(self, node, parts, preformatted):
+        if isinstance(node, Tag):
+            self.write_tag(node, parts, preformatted)
+        elif not isinstance(node, PreformattedString):  # comments, doctypes and the like
+            text = escape(str(node), quote=False)
+            if not preformatted:
+                text = WHITESPACE_PATTERN.sub(' ', text)
+                if text.startswith(' ') and parts and parts[-1].endswith(' '):
+                    text = text[1:]  # the space left on either side of a dropped comment
+            parts.append(text)
+
+    def write_tag(self, node, parts, preformatted):
+        if node.name in DROPPED_TAGS:
+            return
+        if node.name == 'img':
+            if node.get('src'):
+                parts.append(IMAGE_PLACEHOLDER.format(escape(node['src'])))
+            return
+
+        parts.append(f'<{node.name}{self.attributes(node)}>')
+        if node.name in VOID_TAGS:
+            return
+        preformatted = preformatted or node.name in PREFORMATTED_TAGS
+        for child in node.contents:
+            self.write(child, parts, preformatted)
+        parts.append(f'</{node.name}>')
+
+    def attributes(self, node):
+        attributes = []
+        for name, value in node.attrs.items():
+            if isinstance(value, list):
+                value = ' '.join(value)
+            if name.lower().startswith('on'):
+                continue
+            if name.lower() in URL_ATTRIBUTES and value.strip().lower().startswith('javascript:'):
+                continue
+            attributes.append(f' {name}="{escape(value)}"')
+        return ''.join(attributes)
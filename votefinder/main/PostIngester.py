@@ -0,0 +1,75 @@
+from collections import Counter
+from datetime import datetime
+
+from django.db.models import Case, F, IntegerField, Value, When
+from votefinder.main.models import Player, PlayerState, Post, Vote, slugify_all_uniquely
+
+
+def find_or_create_players(uid_field, names_by_uid):
+    # the players with the given forum user ids, by id, in at most five queries however many there are:
+    # new ones are created and renamed ones get their new names
+    players = {getattr(player, uid_field): player
+               for player in Player.objects.filter(**{f'{uid_field}__in': names_by_uid})}
+
+    renamed = []
+    for player in players.values():
+        playername = names_by_uid[getattr(player, uid_field)]
+        if player.name != playername:
+            player.name = playername
+            renamed.append(player)
+    Player.objects.bulk_update(renamed, ['name'])
+
+    new_uids = [playeruid for playeruid in names_by_uid if playeruid not in players]
+    if new_uids:
+        new_names = [names_by_uid[playeruid] for playeruid in new_uids]
+        # another update may have just added some of them; those are looked up below with the rest
+        Player.objects.bulk_create([Player(name=playername, slug=slug, **{uid_field: playeruid})
+                                    for playeruid, playername, slug
+                                    in zip(new_uids, new_names, slugify_all_uniquely(new_names, Player))],
+                                   ignore_conflicts=True)
+        players.update({getattr(player, uid_field): player
+                        for player in Player.objects.filter(**{f'{uid_field}__in': new_uids})})
+
+    return players
+
+
+class PostIngester:
+    # Stores one page worth of parsed posts using the same handful of queries no matter how
+    # many posts are on the page: one bulk insert and one id lookup for posts, one bulk insert
+    # for votes, one counter update and two queries to bring the roster up to date.
+    def __init__(self, game):
+        self.game = game
+
+    def store_posts(self, posts):
+        for post in posts:
+            post.game = self.game
+        Post.objects.bulk_create(posts)
+
+        # not every database hands back primary keys from a bulk insert, so look them up again
+        post_ids = dict(Post.objects.filter(game=self.game, post_id__in=[post.post_id for post in posts])
+                        .values_list('post_id', 'id'))
+        for post in posts:
+            post.id = post_ids[post.post_id]
+
+    def store_votes(self, votes):
+        Vote.objects.bulk_create(votes)
+
+    def count_posts(self, posts):
+        posts_by_author = Counter(post.author.id for post in posts)
+        if not posts_by_author:
+            return
+
+        Player.objects.filter(id__in=posts_by_author).update(
+            total_posts=F('total_posts') + Case(
+                *[When(id=author_id, then=Value(count)) for author_id, count in posts_by_author.items()],
+                default=Value(0), output_field=IntegerField()),
+            last_post=datetime.now())
+
+    def add_to_roster(self, players, default_state):
+        in_game = set(PlayerState.objects.filter(game=self.game, player__in=players).values_list('player_id', flat=True))
+        new_states = []
+        for player in players:
+            if player.id not in in_game:
+                new_states.append(PlayerState(game=self.game, player=player, **{default_state: True}))
+                in_game.add(player.id)
+        PlayerState.objects.bulk_create(new_states)
@@ -1,14 +1,56 @@
 import re
 from datetime import timedelta
 
-from votefinder.main.models import (Alias, Game, GameDay, Player, PlayerState,
-                                    Vote)
+from django.db.models import Max
+from votefinder.main.models import PlayerState, Vote
+
+
+class EccoVoteState:
+    # In ecco mode a player can't move their vote off someone who's still alive. This keeps the last
+    # vote of every author in memory for the length of a page ingest so that check costs no queries.
+    def __init__(self, game):
+        gameday = game.days.last()
+        self.day_start_post_id = gameday.start_post_id if gameday else None
+        self.living_ids = set(PlayerState.objects.filter(game=game, alive=True).values_list('player_id', flat=True))
+        last_vote_ids = Vote.objects.filter(game=game).values('author_id').annotate(last_id=Max('id')).values('last_id')
+        self.last_votes = {vote.author_id: vote for vote in Vote.objects.filter(id__in=last_vote_ids)}
+
+    def allows(self, vote):
+        last_vote = self.last_votes.get(vote.author.id)
+        if last_vote is None or vote.unvote or last_vote.unvote:
+            return True
+        if self.day_start_post_id is None or last_vote.post_id < self.day_start_post_id:
+            return True
+        return last_vote.target_id not in self.living_ids
+
+    def record(self, vote):
+        self.last_votes[vote.author.id] = vote
 
 
 class PostParser:
-    def __init__(self):
-        self.players = []
-        self.gamePlayers = []
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.votes = []
+        self.ecco_state = None
+        self.moderator_ids = None
+
+    def vote_is_counted(self, vote):
+        if not vote.game.ecco_mode:
+            return True
+
+        if self.ecco_state is None:
+            self.ecco_state = EccoVoteState(vote.game)
+        if self.ecco_state.allows(vote):
+            self.ecco_state.record(vote)
+            return True
+        return False
+
+    def is_moderator(self, post):
+        # the game's moderators are looked up once per page, like EccoVoteState's living players
+        if self.moderator_ids is None:
+            self.moderator_ids = set(PlayerState.objects.filter(game=post.game, moderator=True)
+                                     .values_list('player_id', flat=True))
+        return post.author.id in self.moderator_ids
 
     def search_line_for_actions(self, post, line):
         # Votes
@@ -26,17 +68,11 @@ class PostParser:
 
                 if vote.target is None and vote.target_string.lower() in {'nolynch', 'no lynch', 'no execute', 'no hang', 'no cuddle', 'no lunch'}:
                     vote.no_execute = True
-            try:
-                game = Game.objects.get(id=post.game.id)  # Is this line necessary? Can't we just use post.game?
-                player_last_vote = Vote.objects.filter(game=post.game, author=post.author).last()
-                current_gameday = GameDay.objects.filter(game=post.game).last()
-                if game.ecco_mode is False or player_last_vote is None or player_last_vote.post_id < current_gameday.start_post.id or player_last_vote.unvote or vote.unvote or PlayerState.get(game=game, player_id=player_last_vote.target).alive is False:
-                    vote.save()
-            except Game.DoesNotExist:
-                vote.save()
+            if self.vote_is_counted(vote):
+                self.votes.append(vote)
             match = pattern.search(line, match.end())
 
-        if post.game.is_player_mod(post.author):
+        if self.is_moderator(post):
             # pattern search for ##move and 3 wildcards pattern = re.compile("##\\s*move[:\\s+]([^<\\r\\n]+)", re.I
             # pattern search for ##deadline and # of hours
             pattern = re.compile(r'##\s*deadline[:\s+](\d+)', re.I)
@@ -50,9 +86,7 @@ class PostParser:
                     post.game.deadline = new_deadline
                     post.game.save()
 
-    def read_votes(self, post, game_players, players):
-        self.gamePlayers = game_players
-        self.players = players
+    def read_votes(self, post):
         for quote in post.bodySoup.findAll('div', 'quote well'):
             quote.extract()
         for bold in post.bodySoup.findAll(['b', 'strong']):
@@ -61,36 +95,4 @@ class PostParser:
                 self.search_line_for_actions(post, line)
 
     def autoresolve_vote(self, text, game):
-        try:
-            if game.home_forum == 'bnr':
-                player = Player.objects.get(bnr_uid__isnull=False, name__iexact=text)
-            elif game.home_forum == 'sa':
-                player = Player.objects.get(sa_uid__isnull=False, name__iexact=text)
-            if player in self.players or player in self.gamePlayers:
-                return player
-        except Player.DoesNotExist:
-            pass  # noqa: WPS420
-
-        try:
-            aliases = Alias.objects.filter(alias__iexact=text, player__in=self.players)
-            if aliases:
-                return aliases[0].player
-        except Alias.DoesNotExist:
-            pass  # noqa: WPS420
-
-        try:
-            aliases = Alias.objects.filter(alias__iexact=text, player__in=self.gamePlayers)
-            if aliases:
-                return aliases[0].player
-        except Alias.DoesNotExist:
-            pass  # noqa: WPS420
-
-        try:
-            if len(text) > 4:
-                players = Player.objects.filter(name__icontains=text, name__in=[player.name for player in self.gamePlayers])
-                if len(players) == 1:
-                    return players[0]
-        except Player.DoesNotExist:
-            pass  # noqa: WPS420
-
-        return None
+        return self.resolver.resolve(text)
@@ -1,37 +1,114 @@
+import json
 import re
 import logging
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
 
 from bs4 import BeautifulSoup
 from django.conf import settings
+from votefinder.main.models import CookieStore
 
 import logging
 logger = logging.getLogger(__name__)
 
+# the CookieStore row holding the SA login cookies
+SA_COOKIE_STORE_ID = 1
+
+
+class ForumSession:
+    # The one requests session every SAForumPageDownloader in this process shares, so connections to SA
+    # are kept alive between updates. It starts out with the login cookies saved in CookieStore, so a
+    # login made by any process is reused by all of them and most updates never have to log in.
+    def __init__(self):
+        # held while the session is set up and while its cookies are loaded, replaced or logged in for
+        self.lock = threading.Lock()
+        self.session = None
+        self.cookie_text = None
+        self.generation = 0  # goes up whenever the cookies change
+
+    def get(self):
+        if self.session is not None:
+            return self.session
+        with self.lock:
+            if self.session is None:
+                session = requests.Session()
+                session.headers.update({'User-Agent': 'Mozilla/5.0'})
+                # we must set this, SA blocks the default UA
+                session.mount('https://', HTTPAdapter(pool_maxsize=max(settings.VF_CATCHUP_WORKERS, 10)))
+                self.session = session
+                self.load_cookies()
+            return self.session
+
+    def load_cookies(self):
+        # picks up cookies another process has saved since we last looked; False if there are none
+        stored = CookieStore.objects.filter(id=SA_COOKIE_STORE_ID).values_list('cookie', flat=True).first()
+        if not stored or stored == self.cookie_text:
+            return False
+        cookies = [cookie for cookie in json.loads(stored) if cookie['expires'] is None or cookie['expires'] > time.time()]
+        if not cookies:
+            # the login has run out, so nobody should pick these up again
+            CookieStore.objects.filter(id=SA_COOKIE_STORE_ID, cookie=stored).delete()
+            return False
+        self.cookie_text = stored
+        self.generation += 1
+        for cookie in cookies:
+            self.session.cookies.set_cookie(create_cookie(**cookie))
+        return True
+
+    def save_cookies(self):
+        self.cookie_text = json.dumps([{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain,
+                                        'path': cookie.path, 'expires': cookie.expires, 'secure': cookie.secure}
+                                       for cookie in self.session.cookies])
+        self.generation += 1
+        CookieStore.objects.update_or_create(id=SA_COOKIE_STORE_ID, defaults={'cookie': self.cookie_text})
+
+    def forget_cookies(self):
+        # the forum has turned these cookies down; the stored copy goes too, unless someone has replaced it
+        self.session.cookies.clear()
+        if self.cookie_text is not None:
+            CookieStore.objects.filter(id=SA_COOKIE_STORE_ID, cookie=self.cookie_text).delete()
+        self.cookie_text = None
+
+
+forum_session = ForumSession()
+
 
 class SAForumPageDownloader():
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': 'Mozilla/5.0'})
-        # we must set this, SA blocks the default UA
+        self.session = forum_session.get()
 
     def download(self, page):
+        generation = forum_session.generation
         page_data = self.perform_download(page)
 
         if page_data is None:
             return None
         elif not self.needs_to_login(page_data):
             return page_data
-        elif self.login_to_forum():
+        elif self.log_in(generation):
             page_data = self.perform_download(page)
 
-            if not self.needs_to_login(page_data):
+            if page_data is not None and not self.needs_to_login(page_data):
                 return page_data
             return None
         return None
 
+    def log_in(self, generation):
+        # only one thread logs in at a time, and not at all if someone else already has since our download started
+        with forum_session.lock:
+            if forum_session.generation != generation or forum_session.load_cookies():
+                return True
+            forum_session.forget_cookies()
+            if self.login_to_forum():
+                forum_session.save_cookies()
+                return True
+            return False
+
     def login_to_forum(self):
         if settings.VF_SA_USER:
             self.logger.info(f'Logging into Something Awful forums as user "{settings.VF_SA_USER}"...')
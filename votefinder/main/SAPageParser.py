@@ -1,16 +1,20 @@
+import hashlib
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from bs4 import BeautifulSoup
-from votefinder.main.models import (Game, GameDay, Player, PlayerState,
+from django.conf import settings
+from votefinder.main.models import (Game, GameDay, PlayerState,
                                     Post)
 
-from votefinder.main import SAForumPageDownloader, PostParser
+from votefinder.main import (SAForumPageDownloader, SAPageReader, PageArchive, PostBodySerializer, PostIngester,
+                             PostParser, VoteResolver)
+from votefinder.main.SAPageReader import PAGE_OPTION_PATTERN, PAGES_PATTERN, POST_ID_PATTERN
 
 
 class SAPageParser:
-    def __init__(self):
+    def __init__(self, offline=False):
         self.pageNumber = 0
         self.maxPages = 0
         self.gameName = ''
@@ -19,7 +23,9 @@ class SAPageParser:
         self.gamePlayers = []
         self.votes = []
         self.user = None
-        self.downloader = SAForumPageDownloader.SAForumPageDownloader()
+        self.page_reader = SAPageReader.PAGE_READERS[settings.VF_SA_PAGE_PARSER]
+        # offline parsers only ever read pages they're given, such as ones from the page archive
+        self.downloader = None if offline else SAForumPageDownloader.SAForumPageDownloader()
 
     def add_game(self, threadid, state):
         self.new_game = True
@@ -43,31 +49,78 @@ class SAPageParser:
         if game.current_page < game.max_pages:
             page = game.current_page + 1
 
-        return self.download_and_update(
-            f'https://forums.somethingawful.com/showthread.php?threadid={game.thread_id}&pagenumber={page}', game.thread_id)
+        page_html = self.download_forum_page(self.page_url(game.thread_id, page))
+        if not page_html:
+            return None
+        if game.page_fingerprint and self.page_fingerprint(page_html) == game.page_fingerprint:
+            return game  # the same posts as last time, so there's nothing to parse
+
+        return self.parse_page(page_html, game.thread_id)
+
+    def catch_up(self, game, progress=None, lease=None):
+        # Reads the next page the same way update does, which tells us how many pages the thread
+        # really has, then downloads the rest of the missing pages concurrently and ingests them in order
+        new_game = self.update(game)
+        if not new_game:
+            return None
+        game = new_game
+
+        last_page = min(game.max_pages, game.current_page + settings.VF_CATCHUP_MAX_PAGES)
+        urls = [self.page_url(game.thread_id, page) for page in range(game.current_page + 1, last_page + 1)]
+        if progress:
+            progress(game.current_page, game.max_pages)
+        if not urls:
+            return game
+
+        with ThreadPoolExecutor(max_workers=settings.VF_CATCHUP_WORKERS) as pool:
+            downloads = [pool.submit(self.download_forum_page, url) for url in urls]
+            for download in downloads:
+                if lease is not None and not game.renew_lease(lease):
+                    break  # our lease ran out and someone else is updating the game now
+                page_html = download.result()
+                new_game = self.parse_page(page_html, game.thread_id) if page_html else None
+                if not new_game:
+                    break
+                game = new_game
+                if progress:
+                    progress(game.current_page, game.max_pages)
+            for pending in downloads:
+                pending.cancel()  # anything left after stopping early
+
+        return game
+
+    def page_url(self, threadid, page):
+        return f'https://forums.somethingawful.com/showthread.php?threadid={threadid}&pagenumber={page}'
 
     def download_forum_page(self, url):
         return self.downloader.download(url)
 
     def parse_page(self, page_html, threadid):
-        soup = BeautifulSoup(page_html, 'html5lib')
-        self.pageNumber = self.find_page_number(soup)
-        self.maxPages = self.find_max_pages(soup)
-        self.gameName = re.compile(r'\[.*?\]').sub('', self.read_thread_title(soup)).strip()
+        page = self.page_reader(page_html)
+        self.posts = []
+        self.pageNumber = page.page_number()
+        self.maxPages = page.max_pages()
+        self.gameName = re.compile(r'\[.*?\]').sub('', page.thread_title()).strip()
 
-        posts = soup.find_all('table', 'post')
+        posts = page.post_nodes()
         if not posts:
             return None
+        if PageArchive.page_archive is not None:
+            PageArchive.page_archive.store('sa', threadid, self.pageNumber, page_html)
 
-        mod = None
+        known_posts = self.find_known_posts(posts)
         for post_node in posts:
-            new_post = self.read_post_values(post_node)
-            if new_post:
-                if not mod:
-                    mod = new_post.author
+            if self.read_post_id(post_node) not in known_posts:
+                new_post = self.read_post_values(post_node)
+                if new_post:
+                    new_post.page_number = self.pageNumber
+                    self.posts.append(new_post)
+
+        authors = self.find_or_create_players({post.author_uid: post.author_name for post in self.posts})
+        for post in self.posts:
+            post.author = authors[post.author_uid]
+        mod = self.posts[0].author if self.posts else None
 
-                new_post.page_number = self.pageNumber
-                self.posts.append(new_post)
         if self.new_game and self.state == 'pregame':
             day_number = 0
         else:
@@ -88,80 +141,74 @@ class SAPageParser:
         game.max_pages = self.maxPages
         game.current_page = self.pageNumber
         game.name = self.gameName
-        post_parser = PostParser.PostParser()
+        game.page_fingerprint = self.page_fingerprint(page_html)
+        ingester = PostIngester.PostIngester(game)
+        ingester.store_posts(self.posts)
+        resolver = VoteResolver.VoteResolver(game, self.gamePlayers)
+        resolver.load_players([post.author for post in self.posts])
+        for player in self.players:
+            resolver.add_poster(player)
+        post_parser = PostParser.PostParser(resolver)
         for post in self.posts:
-            post.game = game
-            post.save()
-            post_parser.read_votes(post, self.gamePlayers, self.players)
+            post_parser.read_votes(post)
             if post.author not in self.players:
                 self.players.append(post.author)
-            cur_player = post.author
-            cur_player.last_post = datetime.now()
-            cur_player.total_posts += 1
-            cur_player.save()
+            resolver.add_poster(post.author)
+        ingester.store_votes(post_parser.votes)
+        ingester.count_posts(self.posts)
 
         if self.new_game or game.state == 'pregame':
             default_state = 'alive'
         else:
             default_state = 'spectator'
 
-        for player in self.players:
-            player_state, created = PlayerState.objects.get_or_create(game=game, player=player,
-                                                                      defaults={default_state: True})
+        ingester.add_to_roster(self.players, default_state)
 
         if game_created:
             gameday = GameDay(game=game, day_number=day_number, start_post=self.posts[0])
             gameday.save()
 
-        game.save()
+        game.save()  # bumps the version itself if the game has moved on in the thread
+        if self.posts:
+            game.bump_version()
         return game
 
-    def find_page_number(self, soup):
-        pages = soup.find('div', 'pages')
-        if pages:
-            current_page = pages.find(attrs={'selected': 'selected'})
-            if current_page:
-                return current_page['value']
-            return '1'
-        return '1'
-
-    def find_max_pages(self, soup):
-        pages = soup.find('div', 'pages')
-        if pages:
-            option_tags = pages.find_all('option')
-            total_pages = len(option_tags)
-            if total_pages == 0:
-                return 1
-            return total_pages
-        return 1
-
-    def read_thread_title(self, soup):
-        title = soup.find('title')
-        if title:
-            return title.text[:len(title.text) - 29]
-        return None
-
-    def find_or_create_player(self, playername, playeruid):
-        player, created = Player.objects.get_or_create(sa_uid=playeruid,
-                                                       defaults={'name': playername})
-
-        if player.name != playername:
-            player.name = playername
-            player.save()
-
-        return player
-
-    def read_post_values(self, node):
+    def read_archived_page(self, page_html):
+        # every post on a page from the page archive, read the same way parse_page reads new ones
+        page = self.page_reader(page_html)
+        posts = [post for post in map(self.read_post_values, page.post_nodes()) if post]
+        for post in posts:
+            post.page_number = page.page_number()
+        return posts
+
+    def page_fingerprint(self, page_html):
+        # the posts on the page and the thread's page count, straight from the HTML
+        post_ids = POST_ID_PATTERN.findall(page_html)
+        if not post_ids:
+            return ''
+        pages = PAGES_PATTERN.search(page_html)
+        page_options = PAGE_OPTION_PATTERN.findall(pages.group(0)) if pages else []
+        return hashlib.sha1(f'{post_ids}{page_options}'.encode()).hexdigest()  # noqa: S324
+
+    def find_or_create_players(self, names_by_uid):
+        return PostIngester.find_or_create_players('sa_uid', names_by_uid)
+
+    def read_post_id(self, node):
         post_id = node['id'][4:]
         if post_id == '':
             return None
+        return int(post_id)
+
+    def find_known_posts(self, nodes):
+        post_ids = [self.read_post_id(node) for node in nodes]
+        return set(Post.objects.filter(post_id__in=post_ids, game__home_forum='sa').values_list('post_id', flat=True))
 
-        try:
-            post = Post.objects.get(post_id=post_id, game__home_forum='sa')
+    def read_post_values(self, node):
+        post_id = self.read_post_id(node)
+        if post_id is None:
             return None
-        except Post.DoesNotExist:
-            post = Post()
 
+        post = Post()
         post.post_id = post_id
         title_node = node.find('dd', 'title')
         if title_node:
@@ -170,9 +217,7 @@ class SAPageParser:
         post.bodySoup = node.find('td', 'postbody')
         for quote in post.bodySoup.findAll('div', 'bbc-block'):
             quote['class'] = 'quote well'
-        [img.replaceWith(f'<div class="embedded-image not-loaded" data-image="{img["src"]}">Click to load image...</div>') for img in post.bodySoup.find_all('img')]  # noqa: WPS428 false positive
-        post.body = post.bodySoup.prettify(formatter=None)
-        post.body = re.sub(r'google_ad_section_(start|end)', '', post.body)
+        post.body = PostBodySerializer.PostBodySerializer().serialize(post.bodySoup)
         post_date_node = node.find('td', 'postdate')
 
         if post_date_node:
@@ -191,13 +236,12 @@ class SAPageParser:
 
         matcher = re.compile(r'userid=(?P<uid>\d+)').search(post.author_search)
         if matcher:
-            author_uid = matcher.group('uid')
+            post.author_uid = int(matcher.group('uid'))
         else:
             return None
 
         if author_string == 'Adbot':
             return None
-        else:
-            post.author = self.find_or_create_player(author_string, author_uid)
+        post.author_name = author_string
 
         return post
@@ -0,0 +1,99 @@
+import html
+import re
+
+from bs4 import BeautifulSoup
+
+# the parts of a thread page votefinder reads, found without parsing the page
+POST_ID_PATTERN = re.compile(r'<table[^>]*\bid="post(\d+)"')
+PAGES_PATTERN = re.compile(r'<div[^>]*\bclass="pages\b.*?</div>', re.DOTALL)
+PAGE_OPTION_PATTERN = re.compile(r'<option value="(\d+)"( selected)?')
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.DOTALL | re.IGNORECASE)
+TABLE_TAG_PATTERN = re.compile(r'<(/?)table\b[^>]*>', re.IGNORECASE)
+# the cells of a post's table that SAPageParser reads
+POST_PARTS_PATTERN = re.compile(r'(<dt[^>]*\bclass="author\b.*?</dt>)(?:.*?(<dd[^>]*\bclass="title\b.*?</dd>))?'
+                                r'.*?(<td[^>]*\bclass="postbody\b.*</td>).*?(<td[^>]*\bclass="postdate\b.*?</td>)',
+                                re.DOTALL)
+
+
+class SAPageReader:
+    # Reads a thread page the way a browser would, building html5lib's tree of the whole page.
+    # It copes with any markup but is slow, so it's only used with VF_SA_PAGE_PARSER = 'html5lib'.
+    def __init__(self, page_html):
+        self.soup = BeautifulSoup(page_html, 'html5lib')
+
+    def page_title(self):
+        title = self.soup.find('title')
+        return title.text if title is not None else None
+
+    def page_options(self):
+        # (page number, selected) for every page in the thread's page list
+        pages = self.soup.find('div', 'pages')
+        if pages is None:
+            return []
+        return [(option.get('value'), option.get('selected') == 'selected') for option in pages.find_all('option')]
+
+    def post_nodes(self):
+        return self.soup.find_all('table', 'post')
+
+    def thread_title(self):
+        title = self.page_title()
+        if title is None:
+            return None
+        return title[:len(title) - 29]  # less ' - The Something Awful Forums'
+
+    def page_number(self):
+        for page, selected in self.page_options():
+            if selected:
+                return int(page)
+        return 1
+
+    def max_pages(self):
+        return len(self.page_options()) or 1
+
+
+class StreamingSAPageReader(SAPageReader):
+    # Reads only the parts of a thread page votefinder uses. One pass of regular expressions finds the
+    # title, the page list and where each post's table starts and ends, and then just the author, title,
+    # body and date of each post are parsed with Python's html.parser. The navigation, ads and scripts
+    # around the posts, and the profile links and buttons inside them, are never parsed at all.
+    def __init__(self, page_html):
+        self.page_html = page_html
+
+    def page_title(self):
+        title = TITLE_PATTERN.search(self.page_html)
+        return html.unescape(title.group(1)) if title else None
+
+    def page_options(self):
+        pages = PAGES_PATTERN.search(self.page_html)
+        if pages is None:
+            return []
+        return [(page, bool(selected)) for page, selected in PAGE_OPTION_PATTERN.findall(pages.group(0))]
+
+    def post_nodes(self):
+        starts = [match.start() for match in POST_ID_PATTERN.finditer(self.page_html)]
+        limits = starts[1:] + [len(self.page_html)]
+        return [self.post_node(self.page_html[start:self.table_end(start, limit)])
+                for start, limit in zip(starts, limits)]
+
+    def post_node(self, post_html):
+        parts = POST_PARTS_PATTERN.search(post_html)
+        if parts:
+            author, title, body, date = parts.groups(default='')
+            table_tag = post_html[:post_html.index('>') + 1]
+            post_html = f'{table_tag}<tr><td><dl>{author}{title}</dl></td>{body}</tr><tr>{date}</tr></table>'
+        return BeautifulSoup(post_html, 'html.parser').table
+
+    def table_end(self, start, limit):
+        # where the table starting at start is closed, counting any tables inside it; at most limit
+        depth = 0
+        for tag in TABLE_TAG_PATTERN.finditer(self.page_html, start, limit):
+            depth += -1 if tag.group(1) else 1
+            if depth == 0:
+                return tag.end()
+        return limit
+
+
+PAGE_READERS = {
+    'html5lib': SAPageReader,
+    'streaming': StreamingSAPageReader,
+}
@@ -1,9 +1,11 @@
-import math
 import random
+from datetime import datetime
+
+import simplejson as json
 
 from votefinder.main.models import GameDay, ExecutionMessage, Player, Vote
 
-from votefinder.main import SAForumPageDownloader, VotecountFormatter, BNRApi
+from votefinder.main import SAForumPageDownloader, VotecountFormatter, BNRApi, GameContext
 
 
 class VoteCounter:
@@ -15,33 +17,57 @@ class VoteCounter:
         self.voteLog = []
         self.show_only_active_votes = False
 
-    def run(self, game):
-        gameday = game.days.select_related().last()
+        # the counting itself works on ids; results and currentVote are filled in from these at the end
+        self.players = {}
+        self.living_ids = set()
+        self.tallies = {}
+        self.current_votes = {}
+        # each author's enabled votes on a target, oldest first, so an unvote can switch one off directly
+        self.active_votes = {}
+
+    def run(self, game, context=None):
+        if context is None:
+            context = GameContext.GameContext(game)
+        gameday = context.gameday
 
         try:
-            votes = Vote.objects.select_related().filter(game=game, ignored=False, manual=False,
-                                                         post__id__gte=gameday.start_post.id).order_by('id')
-            manual_votes = Vote.objects.select_related().filter(game=game, ignored=False, manual=True,
-                                                                post__id__gte=gameday.start_post.id).order_by('id')
+            manual_votes = Vote.objects.select_related('post', 'author', 'target').filter(
+                game=game, ignored=False, manual=True, post__id__gte=gameday.start_post.id).order_by('id')
             self.votesFound = True
         except Vote.DoesNotExist:
             return None
 
-        self.livingPlayers = Player.objects.select_related().filter(games__in=game.living_players())
+        self.livingPlayers = sorted((state.player for state in context.living_players), key=lambda player: player.id)
         self.game = game
         self.voteLog = []
-
         for single_player in self.livingPlayers:
-            self.results[single_player] = {'count': 0, 'votes': []}
-            self.currentVote[single_player] = None
-
+            self.players[single_player.id] = single_player
+            self.living_ids.add(single_player.id)
+
+        # pick up from the saved tally if it's still good, so only votes since then need counting
+        tally_vote_id = self.load_tally(gameday)
+        rebuilding = tally_vote_id is None
+        if rebuilding:
+            tally_vote_id = 0
+            for single_player in self.livingPlayers:
+                self.tallies[single_player.id] = {'count': 0, 'votes': []}
+                self.current_votes[single_player.id] = None
+
+        votes = Vote.objects.select_related('post', 'author', 'target').filter(
+            game=game, ignored=False, manual=False, id__gt=tally_vote_id,
+            post__id__gte=gameday.start_post.id).order_by('id')
+        last_vote_id = tally_vote_id
         for single_vote in votes:
-            if single_vote.author in self.livingPlayers and self.target_is_valid(single_vote):
+            last_vote_id = single_vote.id
+            if single_vote.author_id in self.living_ids and self.target_is_valid(single_vote):
                 if single_vote.unvote:
                     self.handle_unvote(single_vote)
                 else:
                     self.handle_vote(single_vote)
 
+        if rebuilding or last_vote_id != tally_vote_id:
+            self.save_tally(gameday, last_vote_id)
+
         # ensure manual votes are applied after all real votes
         for single_manual_vote in manual_votes:
             if self.target_is_valid(single_manual_vote):
@@ -50,25 +76,68 @@ class VoteCounter:
                 else:
                     self.handle_vote(single_manual_vote)
 
-        self.run_notify(game, gameday)
+        self.update_results()
+        self.run_notify(game, gameday, context)
 
         return self.build_result_list()
 
+    def tally_signature(self, gameday):
+        return {'start_post': gameday.start_post_id, 'living': sorted(self.living_ids)}
+
+    def load_tally(self, gameday):
+        # returns the id of the last vote the saved tally includes, or None if it has to be rebuilt
+        if not gameday.tally:
+            return None
+        tally = json.loads(gameday.tally)
+        if tally['signature'] != self.tally_signature(gameday):
+            return None
+
+        if tally['no_execute'] is not None:
+            self.no_execute_player = Player.objects.get(id=tally['no_execute'])
+            self.players[self.no_execute_player.id] = self.no_execute_player
+
+        for target_id, count, votes in tally['results']:
+            self.tallies[target_id] = {'count': count, 'votes': []}
+            for unvote, enabled, author_id, url in votes:
+                vote = {'unvote': unvote, 'enabled': enabled, 'author': self.players[author_id], 'url': url}
+                self.tallies[target_id]['votes'].append(vote)
+                if enabled and not unvote:
+                    self.active_votes.setdefault((author_id, target_id), []).append(vote)
+        self.current_votes = dict(tally['current'])
+        self.voteLog = [{'timestamp': datetime.fromisoformat(timestamp), 'player': player, 'count': count, 'text': text}
+                        for timestamp, player, count, text in tally['log']]
+
+        return gameday.tally_vote_id
+
+    def save_tally(self, gameday, last_vote_id):
+        tally = {
+            'signature': self.tally_signature(gameday),
+            'no_execute': self.no_execute_player.id if self.no_execute_player else None,
+            'results': [[target_id, result['count'], [[vote['unvote'], vote['enabled'], vote['author'].id, vote['url']]
+                                                      for vote in result['votes']]]
+                        for target_id, result in self.tallies.items()],
+            'current': list(self.current_votes.items()),
+            'log': [[entry['timestamp'].isoformat(), entry['player'], entry['count'], entry['text']] for entry in self.voteLog],
+        }
+        # not if the tally has been invalidated since we read it
+        GameDay.objects.filter(id=gameday.id, tally_generation=gameday.tally_generation).update(
+            tally=json.dumps(tally), tally_vote_id=last_vote_id)
+
     def get_votelog(self):
         return self.voteLog
 
-    def run_notify(self, game, gameday):
+    def run_notify(self, game, gameday, context):
         gameday = GameDay.objects.get(id=gameday.id)  # reload to prevent double posts from 2 threads updating at once
         if gameday.notified:
             return
 
-        to_execute = int(math.floor(len(game.living_players()) / 2.0) + 1)
-        executed = filter(lambda key: self.results[key]['count'] >= to_execute, self.results)
+        executed = filter(lambda key: self.results[key]['count'] >= context.to_execute, self.results)
         list_executed = list(executed)  # exhausts iterator - py3
         if len(list_executed) == 1:
             executee = list_executed[0]
-            gameday.notified = True
-            gameday.save()
+            # an UPDATE rather than save(), which would send a signal that throws the day's tally away
+            if not GameDay.objects.filter(id=gameday.id, notified=False).update(notified=True):
+                return
             if game.post_executions:
                 game.status_update(f'{executee.name} was executed on day {gameday.day_number}!')
                 self.post_execute_message(game, executee.name)
@@ -87,6 +156,11 @@ class VoteCounter:
             dl = BNRApi.BNRApi()
         dl.reply_to_thread(game.thread_id, message.format(name))
 
+    def update_results(self):
+        self.results = {self.players[target_id]: tally for target_id, tally in self.tallies.items()}
+        self.currentVote = {self.players[author_id]: self.players[target_id] if target_id is not None else None
+                            for author_id, target_id in self.current_votes.items()}
+
     def build_result_list(self):
         resultlist = []
         for key, votes_by_player in self.results.items():
@@ -99,23 +173,26 @@ class VoteCounter:
     def target_is_valid(self, vote):
         if vote.no_execute and self.no_execute_player is None:
             self.no_execute_player = Player.objects.get(sa_uid=-1)
-            self.results[self.no_execute_player] = {'count': 0, 'votes': []}
+            self.players[self.no_execute_player.id] = self.no_execute_player
+            self.tallies[self.no_execute_player.id] = {'count': 0, 'votes': []}
 
-        return vote.unvote or vote.no_execute or (vote.target in self.livingPlayers)
+        return vote.unvote or vote.no_execute or (vote.target_id in self.living_ids)
 
     def handle_vote(self, vote):
-        if not vote.manual and self.player_is_voting(vote.author):
+        if not vote.manual and self.player_is_voting(vote.author_id) is not None:
             self.handle_unvote(vote)
 
         if vote.no_execute:
             vote.target = self.no_execute_player
 
-        self.add_vote_to_player(vote.target, vote.author, False, vote.post.page_number, vote.post.post_id,  # noqa: WPS425
-                                vote.post.timestamp)
-        self.currentVote[vote.author] = vote.target
+        self.players.setdefault(vote.author_id, vote.author)
+        self.add_vote_to_player(vote.target_id, vote.author_id, False, vote.post)  # noqa: WPS425
+        self.current_votes[vote.author_id] = vote.target_id
 
-    def add_vote_to_player(self, target, author, unvote, page, postid, timestamp):
-        result_item = self.results[target]
+    def add_vote_to_player(self, target_id, author_id, unvote, post):
+        result_item = self.tallies[target_id]
+        author = self.players[author_id]
+        target = self.players[target_id]
         if unvote:
             result_item['count'] -= 1
             text = f'{author} unvotes'
@@ -123,29 +200,31 @@ class VoteCounter:
             result_item['count'] += 1
             text = f'{author} votes {target}'
 
-        self.voteLog.append({'timestamp': timestamp, 'player': target.name, 'count': result_item['count'], 'text': text})
+        self.voteLog.append({'timestamp': post.timestamp, 'player': target.name, 'count': result_item['count'], 'text': text})
         if self.game.home_forum == 'sa':
-            result_item['votes'].append({'unvote': unvote, 'enabled': True, 'author': author,
-                                        'url': f'https://forums.somethingawful.com/showthread.php?threadid={self.game.thread_id}&pagenumber={page}#post{postid}'})
+            url = f'https://forums.somethingawful.com/showthread.php?threadid={self.game.thread_id}&pagenumber={post.page_number}#post{post.post_id}'
         elif self.game.home_forum == 'bnr':
-            result_item['votes'].append({'unvote': unvote, 'enabled': True, 'author': author,
-                                        'url': f'https://breadnroses.net/threads/{self.game.thread_id}/post-{postid}'})
+            url = f'https://breadnroses.net/threads/{self.game.thread_id}/post-{post.post_id}'
+        else:
+            return
 
-    def handle_unvote(self, vote):
-        current_vote = self.player_is_voting(vote.author)
-        if current_vote:
-            self.disable_current_vote(vote.author, current_vote)
-            self.add_vote_to_player(current_vote, vote.author, True, vote.post.page_number, vote.post.post_id,  # noqa: WPS425
-                                    vote.post.timestamp)
-        self.currentVote[vote.author] = None
-
-    def disable_current_vote(self, player, target):
-        for vote in self.results[target]['votes']:
-            if vote['author'] == player and vote['unvote'] is False and vote['enabled']:
-                vote['enabled'] = False
-                return
+        vote = {'unvote': unvote, 'enabled': True, 'author': author, 'url': url}
+        result_item['votes'].append(vote)
+        if not unvote:
+            self.active_votes.setdefault((author_id, target_id), []).append(vote)
 
-    def player_is_voting(self, player):
-        if player in self.currentVote.keys():
-            return self.currentVote[player]
-        return None
+    def handle_unvote(self, vote):
+        current_vote = self.player_is_voting(vote.author_id)
+        if current_vote is not None:
+            self.disable_current_vote(vote.author_id, current_vote)
+            self.add_vote_to_player(current_vote, vote.author_id, True, vote.post)  # noqa: WPS425
+        self.players.setdefault(vote.author_id, vote.author)
+        self.current_votes[vote.author_id] = None
+
+    def disable_current_vote(self, author_id, target_id):
+        active_votes = self.active_votes.get((author_id, target_id))
+        if active_votes:
+            active_votes.pop(0)['enabled'] = False
+
+    def player_is_voting(self, author_id):
+        return self.current_votes.get(author_id)
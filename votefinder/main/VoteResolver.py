@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from votefinder.main.models import Alias, Game, PlayerState
+
+ALIAS_CACHE_SECONDS = 60 * 60
+
+
+class VoteResolver:
+    # Works out who a ##vote is aimed at without touching the database. It follows the same
+    # rules PostParser always has, in the same order:
+    #   1. an exact (case insensitive) name of someone who posted or is playing
+    #   2. an alias of someone who has posted
+    #   3. an alias of someone who is playing
+    #   4. a unique piece of a player's name, for anything longer than four characters
+    # The aliases of everyone in the game are cached under the game's version, so any change to the
+    # roster leaves them behind; call invalidate_player() when a player's aliases change.
+    def __init__(self, game, game_players):
+        self.game = game
+        self.game_players = list(game_players)
+        self.game_player_ids = {player.id for player in self.game_players}
+        self.players_by_id = {player.id: player for player in self.game_players}
+        self.poster_ids = set()
+        self.names = {}
+        self.aliases = {}
+        self.loaded_ids = set()
+
+        cached = cache.get(self.cache_key(game))
+        if cached is None:
+            rows = PlayerState.objects.filter(game=game).order_by('player__alias__id').values_list(
+                'player_id', 'player__alias__id', 'player__alias__alias')
+            cached = ({player_id for player_id, alias_id, alias in rows},
+                      [(alias_id, alias, player_id) for player_id, alias_id, alias in rows if alias_id is not None])
+            cache.set(self.cache_key(game), cached, ALIAS_CACHE_SECONDS)
+        player_ids, aliases = cached
+        self.add_aliases(aliases)
+        self.loaded_ids.update(player_ids)
+
+        for player in self.game_players:
+            self.add_name(player)
+
+    @classmethod
+    def cache_key(cls, game):
+        return game.cache_key('vote-resolver-aliases')
+
+    @classmethod
+    def invalidate_player(cls, player):
+        games = Game.objects.filter(players__player=player).only('id', 'version')
+        cache.delete_many([cls.cache_key(game) for game in games])
+
+    def add_aliases(self, aliases):
+        for alias_id, alias, player_id in aliases:
+            self.aliases.setdefault(alias.casefold(), []).append((alias_id, player_id))
+
+    def add_name(self, player):
+        if self.game.home_forum == 'bnr' and player.bnr_uid is None:
+            return
+        if self.game.home_forum == 'sa' and player.sa_uid is None:
+            return
+        self.names.setdefault(player.name.casefold(), player)
+
+    def load_players(self, players):
+        # fetch aliases for anyone who isn't in the game yet, all at once
+        missing = {player.id for player in players} - self.loaded_ids
+        if missing:
+            self.add_aliases(Alias.objects.filter(player_id__in=missing).values_list('id', 'alias', 'player_id'))
+            self.loaded_ids.update(missing)
+
+    def add_poster(self, player):
+        if player.id not in self.poster_ids:
+            self.poster_ids.add(player.id)
+            self.players_by_id[player.id] = player
+            self.add_name(player)
+
+    def resolve(self, text):
+        text = text.casefold()
+
+        player = self.names.get(text)
+        if player is not None:
+            return player
+
+        aliases = self.aliases.get(text, [])
+        for candidates in (self.poster_ids, self.game_player_ids):
+            matches = [(alias_id, player_id) for alias_id, player_id in aliases if player_id in candidates]
+            if matches:
+                return self.players_by_id[min(matches)[1]]
+
+        if len(text) > 4:
+            players = [player for player in self.game_players if text in player.name.casefold()]
+            if len(players) == 1:
+                return players[0]
+
+        return None
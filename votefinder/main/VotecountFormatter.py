@@ -1,58 +1,108 @@
-import math
+import html
 import re
 from datetime import datetime
 
 from pytz import timezone
 
 from django.conf import settings
+from django.core.cache import cache
 from django.utils.dateformat import format
 from django.utils.timesince import timeuntil
 from django.template import Template, Context
 
 from votefinder.main.models import Comment, VotecountTemplate
 
-from votefinder.main import VoteCounter
+from votefinder.main import GameContext
 
 import logging
 logger = logging.getLogger(__name__)
 
+DEFAULT_TEMPLATE_CACHE_KEY = 'votecount-default-template'
+DEFAULT_TEMPLATE_CACHE_SECONDS = 60
+
+# compiled votecount templates for this process: template id -> (version, compiled), one version per template
+compiled_templates = {}
+
+LINE_VARIABLE = re.compile(r'{{\s*(\w+)\s*}}')
+LINE_VARIABLE_NAMES = frozenset(('ticks', 'target', 'count', 'votelist'))
+
+
+class LineTemplate:
+    # single_line is rendered once for every player with votes, so a line that only fills in
+    # plain {{ variables }} is split up once and pasted together here instead of going through
+    # the template engine. Anything fancier (filters, tags) still gets a real Template.
+    def __init__(self, source):
+        self.parts = LINE_VARIABLE.split(source)
+        literal = ''.join(self.parts[0::2])
+        variables = set(self.parts[1::2])
+        self.template = None
+        if '{{' in literal or '{%' in literal or '{#' in literal or not variables <= LINE_VARIABLE_NAMES:
+            self.template = Template(source)
+
+    def render(self, values):
+        if self.template is not None:
+            return self.template.render(context=Context(values))
+        # the same escaping the template engine would do, without its SafeString bookkeeping
+        return ''.join(part if index % 2 == 0 else html.escape(str(values[part]))
+                       for index, part in enumerate(self.parts))
+
+
+def compile_template(votecount_template):
+    version, compiled = compiled_templates.get(votecount_template.id, (None, None))
+    if compiled is None or version != votecount_template.version:
+        compiled = {
+            'overall': Template(votecount_template.overall),
+            'single_line': LineTemplate(votecount_template.single_line + "\n"),
+            'deadline_exists': Template(votecount_template.deadline_exists),
+        }
+        if votecount_template.id is not None:
+            compiled_templates[votecount_template.id] = (votecount_template.version, compiled)
+    return compiled
+
+
+def forget_template(template_id):
+    compiled_templates.pop(template_id, None)
+    cache.delete(DEFAULT_TEMPLATE_CACHE_KEY)
+
+
+def default_template():
+    votecount_template = cache.get(DEFAULT_TEMPLATE_CACHE_KEY)
+    if votecount_template is None:
+        votecount_template = VotecountTemplate.objects.get(system_default=True)
+        cache.set(DEFAULT_TEMPLATE_CACHE_KEY, votecount_template, DEFAULT_TEMPLATE_CACHE_SECONDS)
+    return votecount_template
+
+
+def deadline_fields(game):
+    # the parts of a game_state that change with the clock rather than with the game
+    if not game.deadline:
+        return {'deadline': '', 'until_deadline': ''}
+    tz = timezone(game.timezone)
+    dl = timezone(settings.TIME_ZONE).localize(game.deadline).astimezone(tz)
+    until_deadline = timeuntil(game.deadline, datetime.now())
+    return {'deadline': format(dl, r'F dS, Y \a\t P ') + dl.tzname(),
+            'until_deadline': until_deadline.replace('\u00A0', ' ')}
+
 
 class VotecountFormatter:
-    def __init__(self, game):
+    def __init__(self, game, context=None):
         self.empty_tick = ''
         self.tick = ''
 
-        self.vc = VoteCounter.VoteCounter()
         self.game = game
+        self.context = context if context is not None else GameContext.GameContext(game)
 
     def go(self, show_comment=True):
         # Pull together all data needed to determine vote state for game
-        self.counted_votes = self.vc.run(self.game)
+        self.vc = self.context.vote_counter
+        self.counted_votes = self.context.counted_votes
 
-        # Getting game template - this is going to be heavily reworked,
-        # when we do that, make sure to pay close attention to anything
-        # referring to templates
-        self.game_template = self.game.template
-        if self.game_template is None:
-            self.game_template = VotecountTemplate.objects.get(system_default=True)
-
-        self.gameday = self.game.days.select_related().last()
-        living_players = [ps.player for ps in self.game.living_players()]
+        self.load_template()
 
-        if self.game.deadline:
-            tz = timezone(self.game.timezone)
-            dl = timezone(settings.TIME_ZONE).localize(self.game.deadline).astimezone(tz)
-            deadline = format(dl, r'F dS, Y \a\t P ') + dl.tzname()
-            until_deadline = timeuntil(self.game.deadline, datetime.now())
-            until_deadline = until_deadline.replace('\u00A0', ' ')
-        else:
-            deadline = ''
-            until_deadline = ''
+        self.gameday = self.context.gameday
+        living_players = [ps.player for ps in self.context.living_players]
 
-        self.to_execute = int(math.floor(len(living_players)/ 2.0) + 1)
-        self.detail_level = self.game_template.detail_level
-        self.tick = self.game_template.full_tick
-        self.empty_tick = self.game_template.empty_tick
+        self.to_execute = self.context.to_execute
         self.comments = Comment.objects.filter(game=self.game).order_by('-timestamp') if show_comment else ''
 
         self.not_voting_list = sorted(
@@ -67,8 +117,7 @@ class VotecountFormatter:
             'to_execute': self.to_execute,
             'votecounts_by_player': [],
             'not_voting': [x.name for x in self.not_voting_list],
-            'deadline': deadline,
-            'until_deadline': until_deadline
+            **deadline_fields(self.game)
         }
 
         # Creating votecount for each player
@@ -83,16 +132,34 @@ class VotecountFormatter:
             else:
                 self.game_state['votecounts_by_player'].append(new_player)
 
+    def show(self, game_state):
+        # formats a game_state worked out earlier, without counting the votes again
+        self.load_template()
+        self.to_execute = game_state['to_execute']
+        self.game_state = game_state
+
+    def load_template(self):
+        # Getting game template - this is going to be heavily reworked,
+        # when we do that, make sure to pay close attention to anything
+        # referring to templates
+        self.game_template = self.game.template
+        if self.game_template is None:
+            self.game_template = default_template()
+
+        self.detail_level = self.game_template.detail_level
+        self.tick = self.game_template.full_tick
+        self.empty_tick = self.game_template.empty_tick
+
     # It might be nice to replace this with another inclusion tag, like how
     # the HTML votecount is generated - this works for now, though
     def get_bbcode(self):
         if settings.VF_DEBUG == True:
             logger.debug("Have called get_bbcode")
-        game_template = Template(self.game_template.overall)
-        
+        compiled = compile_template(self.game_template)
+
         # Get together individual votecount lines
         votecount = ""
-        template_single_line = Template(self.game_template.single_line + "\n")
+        template_single_line = compiled['single_line']
         for x in self.game_state['votecounts_by_player']:
             if len(x['votes']) > 0:
                 votelist = []
@@ -108,18 +175,18 @@ class VotecountFormatter:
 
                 ticks = (f"⚪" * (self.to_execute - x['votes_received'])) + f"🟢" * x['votes_received']
 
-                votecount += template_single_line.render(context = Context({'ticks': ticks,'target': x['player_name'], 'count': x['votes_received'], 'votelist': votelist_string}))
+                votecount += template_single_line.render({'ticks': ticks,'target': x['player_name'], 'count': x['votes_received'], 'votelist': votelist_string})
 
         # Figure out deadline
         if self.game_state['deadline'] == '':
             deadline = self.game_template.deadline_not_set
         else:
-            deadline = Template(self.game_template.deadline_exists).render(Context({
+            deadline = compiled['deadline_exists'].render(Context({
                 'deadline': self.game_state['deadline'],
                 'timeuntildeadline': self.game_state['until_deadline']
             }))
 
-        return game_template.render(context = Context({
+        return compiled['overall'].render(context = Context({
             'day': self.game_state['gameday'],
             'votecount': votecount,
             'notvoting': f"Not voting: {', '.join(self.game_state['not_voting'])}" if len(self.game_state['not_voting']) != 0 else '',
@@ -133,7 +200,9 @@ class VotecountFormatter:
     # a find-and-replace to pop out HTML-escaped unicode that Votefinder will
     # nicely post in a thread
     def get_escaped_bbcode(self):
-        to_replace = self.get_bbcode()
+        return self.escape_bbcode(self.get_bbcode())
+
+    def escape_bbcode(self, to_replace):
         to_replace = to_replace.replace("amp;","")
         to_replace = to_replace.replace("🟢","&#x1F7E2;")
         to_replace = to_replace.replace("⚪","&#x26AA;")
@@ -1,10 +1,24 @@
 from django.conf import settings
 from django.contrib.syndication.views import Feed
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django.utils.feedgenerator import Atom1Feed
+from django.views.decorators.http import condition
 from votefinder.main.models import BlogPost, Game, GameStatusUpdate
 
 
+# feeds only change when something is added to them, so the newest id makes a good ETag
+def latest_etag(request, *args, **kwargs):
+    return str(BlogPost.objects.order_by('-id').values_list('id', flat=True).first())
+
+
+def game_status_etag(request, slug=None):
+    updates = GameStatusUpdate.objects.all()
+    if slug is not None:
+        updates = updates.filter(game__slug=slug)
+    return str(updates.order_by('-id').values_list('id', flat=True).first())
+
+
 class LatestRss(Feed):
     title = 'Votefinder Updates'
     link = f'https://{settings.VF_PRIMARY_DOMAIN}/'
@@ -13,6 +27,10 @@ class LatestRss(Feed):
     description = 'Changes and updates to the Votefinder site.'
     guid = '/'
 
+    @method_decorator(condition(etag_func=latest_etag))
+    def __call__(self, request, *args, **kwargs):
+        return super().__call__(request, *args, **kwargs)
+
     def items(self):  # noqa: WPS110
         return BlogPost.objects.all().order_by('-timestamp')[:5]
 
@@ -42,6 +60,10 @@ class GameStatusRss(Feed):
     description = 'Game status updates for games tracked by Votefinder.'
     guid = '/'
 
+    @method_decorator(condition(etag_func=game_status_etag))
+    def __call__(self, request, *args, **kwargs):
+        return super().__call__(request, *args, **kwargs)
+
     def items(self):  # noqa: WPS110
         return GameStatusUpdate.objects.all().order_by('-id')[:5]
 
@@ -74,6 +96,10 @@ class SpecificGameStatusRss(Feed):
     guid = '/'
     game = None
 
+    @method_decorator(condition(etag_func=game_status_etag))
+    def __call__(self, request, *args, **kwargs):
+        return super().__call__(request, *args, **kwargs)
+
     def get_object(self, request, slug):
         self.game = get_object_or_404(Game, slug=slug)
         return self.game
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from votefinder.main.models import Game
+
+
+class Command(BaseCommand):
+    help = ('Moves the post bodies of closed games into compressed archives, a game at a time. '
+            'Games are archived when they close, so this is only needed for games closed before that.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='archive at most this many games')
+
+    def handle(self, *args, **options):
+        games = Game.objects.filter(state='closed', posts_archived=False).order_by('id')
+        if options['limit'] is not None:
+            games = games[:options['limit']]
+
+        for game in games:
+            game.archive_post_bodies()
+            self.stdout.write(f'Archived {game} ({game.post_archives.count()} pages)')
@@ -0,0 +1,70 @@
+import os
+import signal
+import socket
+import sys
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from votefinder.main import AutoUpdater
+from votefinder.main.models import UpdaterLease, UpdaterNode
+
+
+class Command(BaseCommand):
+    help = ('Keeps open games up to date, checking busy games often and quiet ones less so. Runs until stopped. '
+            'Any number of copies, on one host or several, can share the games through the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.VF_AUTOUPDATE_WORKERS)
+        parser.add_argument('--tick', type=float, default=5, help='seconds between sweeps for due games')
+        parser.add_argument('--node', default=f'{socket.gethostname()}-{os.getpid()}',
+                            help='name this copy records its leases and stats under')
+        parser.add_argument('--once', action='store_true', help='update every open game once, then exit')
+        parser.add_argument('--stats', action='store_true', help='show what every node has done, then exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.show_stats()
+            return
+
+        if options['once']:
+            updater = AutoUpdater.AutoUpdater(options['workers'], settings.VF_AUTOUPDATE_MIN_SECONDS,
+                                              settings.VF_AUTOUPDATE_MAX_SECONDS)
+            started = time.perf_counter()
+            updater.sweep()
+            updater.wait()
+            stats = updater.sweep()
+            updater.shutdown()
+            self.stdout.write(f'{stats.finished} games updated in {time.perf_counter() - started:.2f}s: {stats}')
+            return
+
+        leases = AutoUpdater.NodeLeases(options['node'], settings.VF_AUTOUPDATE_LEASE_SECONDS,
+                                        settings.VF_AUTOUPDATE_BATCH_SIZE)
+        updater = AutoUpdater.AutoUpdater(options['workers'], settings.VF_AUTOUPDATE_MIN_SECONDS,
+                                          settings.VF_AUTOUPDATE_MAX_SECONDS, leases=leases)
+        # stopping the service hands this node's games straight to the others
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:  # noqa: WPS457
+                stats = updater.sweep()
+                if stats.started or stats.finished:
+                    self.stdout.write(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {options["node"]}: {stats}')
+                time.sleep(options['tick'])
+        except KeyboardInterrupt:
+            pass  # noqa: WPS420
+        finally:
+            updater.shutdown()
+
+    def show_stats(self):
+        alive_since = datetime.now() - timedelta(seconds=settings.VF_AUTOUPDATE_LEASE_SECONDS)
+        for node in UpdaterNode.objects.order_by('name'):
+            alive = node.heartbeat_at is not None and node.heartbeat_at >= alive_since
+            minutes = max((datetime.now() - node.started_at).total_seconds() / 60, 1 / 60)
+            updates = node.games_updated + node.updates_failed
+            average = node.update_seconds / updates if updates else 0
+            self.stdout.write(f'{node.name}: {"running" if alive else "stopped"}, '
+                              f'{UpdaterLease.objects.filter(node=node.name).count()} games, '
+                              f'{node.games_updated} updated, {node.updates_failed} failed, '
+                              f'{updates / minutes:.1f} updates/min, {average:.2f}s average')
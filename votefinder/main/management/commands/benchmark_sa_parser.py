@@ -0,0 +1,82 @@
+import gzip
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from votefinder.main import SAPageParser, SAPageReader
+
+
+class Command(BaseCommand):
+    help = 'Times each SA page reader over saved thread pages and checks that they read the same posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pages', nargs='+',
+                            help='saved thread pages, or directories of them (*.html, or the *.gz of the page archive)')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        pages = [self.read_page_file(path) for path in self.page_files(options['pages'])]
+        if not pages:
+            raise CommandError('No saved pages found.')
+
+        page_parser = SAPageParser.SAPageParser(offline=True)
+        results = {}
+        timings = {}
+        for name, page_reader in SAPageReader.PAGE_READERS.items():
+            elapsed = 0
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                results[name] = [self.read_page(page_parser, page_reader, page_html) for page_html in pages]
+                elapsed += time.perf_counter() - started
+            timings[name] = elapsed * 1000 / options['runs'] / len(pages)
+
+        self.stdout.write(f'{len(pages)} pages, {sum(len(posts) for _, posts in results["html5lib"])} posts')
+        for name, timing in timings.items():
+            self.stdout.write(f'{name}: {timing:.1f} ms/page ({timings["html5lib"] / timing:.1f}x html5lib)')
+        for name, result in results.items():
+            if name != 'html5lib':
+                self.compare(name, results['html5lib'], result)
+
+    def page_files(self, paths):
+        for path in map(Path, paths):
+            if path.is_dir():
+                yield from sorted([*path.rglob('*.html'), *path.rglob('*.gz')])
+            else:
+                yield path
+
+    def read_page_file(self, path):
+        content = path.read_bytes()
+        if path.suffix == '.gz':
+            content = gzip.decompress(content)
+        return content.decode('utf-8', errors='replace')
+
+    def read_page(self, page_parser, page_reader, page_html):
+        # everything parse_page reads from a page, short of touching the database
+        page = page_reader(page_html)
+        posts = [page_parser.read_post_values(node) for node in page.post_nodes()]
+        return (page.page_number(), page.max_pages(), page.thread_title()), [post for post in posts if post]
+
+    def compare(self, name, expected, actual):
+        different_pages = different_posts = different_bodies = 0
+        for (expected_page, expected_posts), (actual_page, actual_posts) in zip(expected, actual):
+            different_pages += expected_page != actual_page
+            if [post.post_id for post in expected_posts] != [post.post_id for post in actual_posts]:
+                different_posts += max(len(expected_posts), len(actual_posts))
+                continue
+            for expected_post, actual_post in zip(expected_posts, actual_posts):
+                different_posts += self.post_fields(expected_post) != self.post_fields(actual_post)
+                different_bodies += expected_post.body != actual_post.body
+
+        if different_pages or different_posts:
+            self.stdout.write(f'{name} disagrees with html5lib on {different_pages} page headers '
+                              f'and the authors, dates or votes of {different_posts} posts')
+        else:
+            self.stdout.write(f'{name} reads the same page headers, authors, dates and votes as html5lib')
+        if different_bodies:
+            self.stdout.write(f'{name} lays out {different_bodies} post bodies differently from html5lib')
+
+    def post_fields(self, post):
+        bold_text = [bold.get_text() for bold in post.bodySoup.find_all(['b', 'strong'])
+                     if not bold.find_parent('div', 'quote well')]
+        return (post.author_name, post.author_uid, post.author_search, post.timestamp, post.avatar, bold_text)
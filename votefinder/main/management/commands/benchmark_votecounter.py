@@ -0,0 +1,76 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from votefinder.main.models import Game, GameDay, Player, PlayerState, Post, Vote
+
+from votefinder.main import VoteCounter
+
+
+class Command(BaseCommand):
+    help = 'Times VoteCounter on a synthetic game day. Nothing is left behind in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=20)
+        parser.add_argument('--votes', type=int, default=1000)
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            game = self.create_game(options['players'], options['votes'])
+
+            full = self.time_runs(game, options['runs'], rebuild=True)
+            self.stdout.write(f'Full replay of {options["votes"]} votes: {full[0]:.2f} ms/run, {full[1]} queries/run')
+            incremental = self.time_runs(game, options['runs'], rebuild=False)
+            self.stdout.write(f'Run with nothing new to count: {incremental[0]:.2f} ms/run, {incremental[1]} queries/run')
+
+            transaction.set_rollback(True)
+
+    def time_runs(self, game, runs, rebuild):
+        elapsed = 0
+        queries = []
+        for _ in range(runs):
+            if rebuild:
+                game.invalidate_tally()
+            game = Game.objects.get(id=game.id)
+            queries.clear()
+            with connection.execute_wrapper(lambda execute, *args: queries.append(1) or execute(*args)):
+                started = time.perf_counter()
+                VoteCounter.VoteCounter().run(game)
+                elapsed += time.perf_counter() - started
+        return elapsed * 1000 / runs, len(queries)
+
+    def create_game(self, player_count, vote_count):
+        rng = random.Random(1)
+        user, _ = User.objects.get_or_create(username='benchmark')
+        base_uid = -1000000
+        players = [Player.objects.create(name=f'Benchmark Player {index}', sa_uid=base_uid - index)
+                   for index in range(player_count + 1)]
+        mod, players = players[0], players[1:]
+
+        game = Game.objects.create(name='Benchmark Game', thread_id=base_uid, moderator=mod, added_by=user,
+                                   max_pages=1, current_page=1, state='started', home_forum='sa')
+        PlayerState.objects.create(game=game, player=mod, moderator=True)
+        PlayerState.objects.bulk_create([PlayerState(game=game, player=player, alive=True) for player in players])
+
+        started = datetime.now() - timedelta(days=1)
+        posts = Post.objects.bulk_create([
+            Post(post_id=base_uid - index, timestamp=started + timedelta(seconds=index), author=rng.choice(players),
+                 author_search='', body='', page_number=index // 40 + 1, game=game)
+            for index in range(vote_count)])
+        posts = list(Post.objects.filter(game=game).order_by('timestamp'))
+        GameDay.objects.create(game=game, day_number=1, start_post=posts[0])
+
+        votes = []
+        for post in posts:
+            if rng.random() < 0.2:
+                votes.append(Vote(post=post, game=game, author=post.author, unvote=True))
+            else:
+                target = rng.choice(players)
+                votes.append(Vote(post=post, game=game, author=post.author, target=target, target_string=target.name))
+        Vote.objects.bulk_create(votes)
+
+        return game
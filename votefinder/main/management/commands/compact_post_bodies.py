@@ -0,0 +1,50 @@
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from votefinder.main.models import Post
+
+from votefinder.main import PostBodySerializer
+
+
+class Command(BaseCommand):
+    help = ('Rewrites stored post bodies as compact HTML, a batch at a time. Bodies that are already compact '
+            'are left alone, so it can be stopped and run again, or resumed with --after.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--after', type=int, default=0, help='start after the post with this id')
+
+    def handle(self, *args, **options):
+        serializer = PostBodySerializer.PostBodySerializer()
+        last_id = options['after']
+        rewritten = size_before = size_after = 0
+
+        while True:
+            posts = list(Post.objects.filter(id__gt=last_id).order_by('id').only('id', 'body')[:options['batch_size']])
+            if not posts:
+                break
+
+            changed = []
+            for post in posts:
+                body = self.compact(serializer, post.body)
+                size_before += len(post.body)
+                size_after += len(body)
+                if body != post.body:
+                    post.body = body
+                    changed.append(post)
+            with transaction.atomic():
+                Post.objects.bulk_update(changed, ['body'])
+
+            rewritten += len(changed)
+            last_id = posts[-1].id
+            self.stdout.write(f'Up to post {last_id}: {rewritten} bodies rewritten')
+
+        if size_before:
+            self.stdout.write(f'Post bodies went from {size_before} to {size_after} characters '
+                              f'({100 * size_after / size_before:.0f}%).')
+
+    def compact(self, serializer, body):
+        soup = BeautifulSoup(body, 'html.parser')
+        # SA bodies used to be stored with the cell they came in
+        cell = soup.find('td', 'postbody', recursive=False)
+        return serializer.serialize(cell if cell is not None else soup)
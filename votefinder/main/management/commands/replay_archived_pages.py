@@ -0,0 +1,43 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from votefinder.main.models import Game
+
+from votefinder.main import GameReplayer, PageArchive
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the posts and votes of games from the page archive (VF_PAGE_ARCHIVE_DIR), a game per worker '
+            'process. Nothing is downloaded.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int)
+        parser.add_argument('--all', action='store_true', help='every game with archived pages')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        archive = PageArchive.page_archive
+        if archive is None:
+            raise CommandError('The page archive is off; set VF_PAGE_ARCHIVE_DIR.')
+
+        game_ids = options['game_ids']
+        if options['all']:
+            game_ids = [game_id for game_id, forum, thread_id in Game.objects.values_list('id', 'home_forum', 'thread_id')
+                        if archive.pages(forum, thread_id)]
+        elif not game_ids:
+            raise CommandError('Give the ids of the games to replay, or --all.')
+
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as pool:
+            replays = {pool.submit(GameReplayer.replay_game, game_id): game_id for game_id in game_ids}
+            for replay in as_completed(replays):
+                game_id = replays[replay]
+                try:
+                    pages, posts, new_posts, votes = replay.result()
+                except Exception as error:
+                    self.stderr.write(f'Game {game_id}: {error!r}')
+                    continue
+                self.stdout.write(f'Game {game_id}: {pages} pages, {posts} posts ({new_posts} new), {votes} votes')
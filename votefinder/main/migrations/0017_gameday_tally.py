@@ -0,0 +1,23 @@
+# Generated by Django 4.2.13 on 2026-10-18 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_userprofile_discord_username'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameday',
+            name='tally',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='gameday',
+            name='tally_vote_id',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_gameday_tally'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votecounttemplate',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_votecounttemplate_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='lock_token',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+    ]
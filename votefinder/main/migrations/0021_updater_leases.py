@@ -0,0 +1,34 @@
+# Generated by Django 4.2.13 on 2026-10-18 07:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_game_lock_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpdaterLease',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='updater_lease', serialize=False, to='main.game')),
+                ('node', models.CharField(blank=True, default='', max_length=64)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UpdaterNode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('games_updated', models.IntegerField(default=0)),
+                ('updates_failed', models.IntegerField(default=0)),
+                ('update_seconds', models.FloatField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0021_updater_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='page_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.13 on 2026-10-18 07:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_game_page_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='posts_archived',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='PostArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.IntegerField()),
+                ('bodies', models.BinaryField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_archives', to='main.game')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='postarchive',
+            constraint=models.UniqueConstraint(fields=('game', 'page_number'), name='unique_game_page_archive'),
+        ),
+    ]
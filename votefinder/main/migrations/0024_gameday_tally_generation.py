@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_post_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gameday',
+            name='tally_generation',
+            field=models.IntegerField(default=0),
+        ),
+    ]
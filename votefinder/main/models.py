@@ -1,11 +1,17 @@
+import json
 import re
+import uuid
+import zlib
+from collections import defaultdict
 from datetime import datetime, timedelta
 from enum import Enum
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.forms import ModelForm
 from django.template.defaultfilters import slugify
 
@@ -37,6 +43,29 @@ def slugify_uniquely(potential_slug, model, slugfield='slug'):
         suffix += 1
 
 
+def slugify_all_uniquely(potential_slugs, model, slugfield='slug'):
+    # slugify_uniquely for many objects that are about to be bulk created, in one query
+    maximum_slug_length = 45
+    bases = [slugify(potential_slug)[:maximum_slug_length] for potential_slug in potential_slugs]
+    if not bases:
+        return []
+    taken_query = models.Q()
+    for base in set(bases):
+        taken_query |= models.Q(**{slugfield: base}) | models.Q(**{f'{slugfield}__startswith': f'{base}-'})
+    taken = set(model.objects.filter(taken_query).values_list(slugfield, flat=True))
+
+    slugs = []
+    for base in bases:
+        suffix = 1
+        actual_slug = base
+        while actual_slug in taken:
+            suffix += 1
+            actual_slug = '-'.join([base, str(suffix)])
+        taken.add(actual_slug)
+        slugs.append(actual_slug)
+    return slugs
+
+
 class Player(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     sa_uid = models.IntegerField(unique=True, db_index=True, null=True)
@@ -86,6 +115,12 @@ class VotecountTemplate(models.Model):
     hide_zero_votes = models.BooleanField(default=False)
     full_tick = models.CharField(max_length=256, default=f'https://{settings.VF_PRIMARY_DOMAIN}/t.png')
     empty_tick = models.CharField(max_length=256, default=f'https://{settings.VF_PRIMARY_DOMAIN}/te.png')
+    version = models.IntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        # compiled copies of a template are cached by id and version, so every save is a new version
+        self.version += 1
+        super().save(*args, **kwargs)
 
     def __str__(self):
         if self.system_default:
@@ -103,7 +138,9 @@ class Game(models.Model):
     max_pages = models.IntegerField()
     current_page = models.IntegerField()
     slug = models.SlugField()
+    # the update lease: whoever set lock_token may read new posts into the game until locked_at + LEASE_SECONDS
     locked_at = models.DateTimeField(null=True, blank=True)
+    lock_token = models.CharField(max_length=32, null=True, blank=True, editable=False)
     # state is 'closed', 'pregame' or 'started'
     state = models.CharField(max_length=32)
     deadline = models.DateTimeField(null=True, blank=True)
@@ -119,6 +156,28 @@ class Game(models.Model):
     players_count = models.IntegerField(default=0)
     created_on = models.DateTimeField(auto_now_add=True, blank=True)
     home_forum = models.CharField(max_length=10, default='sa')
+    # bumped whenever anything a game shows changes; derived data is cached under cache_key()
+    version = models.IntegerField(default=0, editable=False)
+    # what was on the last forum page read, so an update that finds the same page again can stop before parsing it
+    page_fingerprint = models.CharField(max_length=40, blank=True, default='', editable=False)
+    # the bodies of this game's posts have been moved into its PostArchives
+    posts_archived = models.BooleanField(default=False, editable=False)
+
+    LEASE_SECONDS = 60
+    MANAGED_FIELDS = frozenset(('version', 'locked_at', 'lock_token', 'posts_archived'))
+    # fields a save can change without anything the game shows changing with them
+    UNSHOWN_FIELDS = MANAGED_FIELDS | {'last_updated', 'page_fingerprint'}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        game = super().from_db(db, field_names, values)
+        game.saved_values = game.shown_values()
+        return game
+
+    def shown_values(self):
+        # only the fields that have been loaded, so deferred fields aren't fetched just to compare them
+        return {field.attname: self.__dict__[field.attname] for field in self._meta.concrete_fields
+                if field.attname in self.__dict__ and field.name not in self.UNSHOWN_FIELDS}
 
     def update_counts(self):
         self.players_count = self.count_players()
@@ -136,14 +195,62 @@ class Game(models.Model):
         status_update = GameStatusUpdate(game=self, message=message)
         status_update.save()
 
-    def is_locked(self):
-        if self.locked_at is None or datetime.now() - self.locked_at > timedelta(minutes=1):
-            return False
-        return True
-
-    def lock(self, *args, **kwargs):
-        self.locked_at = datetime.now()
-        super().save(*args, **kwargs)  # noqa: WPS613
+    def acquire_lease(self):
+        # Takes the update lease in a single conditional UPDATE, so only one worker can ever win it.
+        # Returns the token to renew and release it with, or None if someone else holds it.
+        token = uuid.uuid4().hex
+        now = datetime.now()
+        expired = models.Q(lock_token=None) | models.Q(locked_at=None) | models.Q(
+            locked_at__lt=now - timedelta(seconds=self.LEASE_SECONDS))
+        if not Game.objects.filter(expired, id=self.id).update(locked_at=now, lock_token=token):
+            return None
+        self.locked_at, self.lock_token = now, token
+        return token
+
+    def renew_lease(self, token):
+        # False if the lease ran out and someone else has taken it since
+        return bool(Game.objects.filter(id=self.id, lock_token=token).update(locked_at=datetime.now()))
+
+    def release_lease(self, token):
+        Game.objects.filter(id=self.id, lock_token=token).update(locked_at=None, lock_token=None)
+
+    def archive_post_bodies(self):
+        # Moves the bodies of a closed game's posts into one compressed PostArchive per page, leaving the
+        # posts themselves with empty bodies. The posts page reads them back from there; restore_post_bodies
+        # puts them back. Posts read into the game since it was last archived are added to their page's archive.
+        with transaction.atomic():
+            pages = defaultdict(dict)
+            for post_id, page_number, body in self.posts.exclude(body='').values_list('post_id', 'page_number', 'body'):
+                pages[page_number][post_id] = body
+            archives = {archive.page_number: archive for archive in
+                        self.post_archives.select_for_update().filter(page_number__in=pages)}
+
+            new_archives = []
+            for page_number, bodies in pages.items():
+                archive = archives.get(page_number)
+                if archive is None:
+                    new_archives.append(PostArchive(game=self, page_number=page_number, bodies=PostArchive.pack(bodies)))
+                else:
+                    archive.bodies = PostArchive.pack({**archive.unpack(), **bodies})
+                    archive.save()
+                self.posts.filter(page_number=page_number, post_id__in=bodies).update(body='')
+            PostArchive.objects.bulk_create(new_archives)
+
+            Game.objects.filter(id=self.id).update(posts_archived=True)
+            self.posts_archived = True
+
+    def restore_post_bodies(self):
+        with transaction.atomic():
+            for archive in self.post_archives.all():
+                bodies = archive.unpack()
+                posts = list(self.posts.filter(page_number=archive.page_number, post_id__in=bodies).only('id', 'post_id'))
+                for post in posts:
+                    post.body = bodies[post.post_id]
+                Post.objects.bulk_update(posts, ['body'])
+            self.post_archives.all().delete()
+
+            Game.objects.filter(id=self.id).update(posts_archived=False)
+            self.posts_archived = False
 
     def __str__(self):
         return self.name
@@ -158,12 +265,30 @@ class Game(models.Model):
                 self.slug = slugify_uniquely(self.name.strip(), self.__class__)
             else:
                 self.slug = slugify_uniquely(filtered_name.strip(), self.__class__)
-        self.locked_at = None
         try:
             self.update_counts()
         except:
             pass
-        super().save(*args, **kwargs)
+        changed = self.id and getattr(self, 'saved_values', None) != self.shown_values()
+        super().save(*args, **self.without_managed_fields(kwargs))
+        self.saved_values = self.shown_values()
+        if changed:
+            self.bump_version()
+
+    def without_managed_fields(self, save_kwargs):
+        # Saving an existing game never writes the version or the lease, which are only ever changed
+        # by their own UPDATEs, so a copy loaded before a bump or a lease change can't wind them back.
+        if self.id and not save_kwargs.get('force_insert') and save_kwargs.get('update_fields') is None:
+            save_kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                            if not field.primary_key and field.name not in self.MANAGED_FIELDS]
+        return save_kwargs
+
+    def bump_version(self):
+        Game.objects.filter(id=self.id).update(version=models.F('version') + 1)
+        self.version = Game.objects.values_list('version', flat=True).get(id=self.id)
+
+    def cache_key(self, name):
+        return f'game-{self.id}-{self.version}-{name}'
 
     def get_absolute_url(self):
         return f'/game/{self.slug}'
@@ -204,13 +329,18 @@ class Game(models.Model):
             return self.is_player_mod(user.profile.player)
         return False
 
+    def invalidate_tally(self):
+        # forces VoteCounter to replay the day from the start, for changes to votes it has already counted
+        GameDay.invalidate_tallies(self.id)
+        self.bump_version()
+
     def winning_faction(self):
         return self.factions.get(winning=True)
     
     # Gets a list (really, a Queryset) of unresolved votes
     # if no votes are unresolved, returns None
     def get_unresolved_votes(self):
-        unresolved_votes = self.votes.filter(target=None, unvote=False, ignored=False, no_execute=False)
+        unresolved_votes = self.votes.select_related('author').filter(target=None, unvote=False, ignored=False, no_execute=False)
 
         return unresolved_votes if len(unresolved_votes) > 0 else None
 
@@ -316,6 +446,29 @@ class Post(models.Model):
         return f'{self.author.name} at {self.timestamp}'
 
 
+class PostArchive(models.Model):
+    # the bodies of one page of a closed game's posts, as zlib-compressed JSON [post_id, body] pairs
+    game = models.ForeignKey(Game, related_name='post_archives', on_delete=models.CASCADE)
+    page_number = models.IntegerField()
+    bodies = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'page_number'], name='unique_game_page_archive'),
+        ]
+
+    @staticmethod
+    def pack(bodies):
+        return zlib.compress(json.dumps(list(bodies.items())).encode(), 9)
+
+    def unpack(self):
+        # post id -> body
+        return dict(json.loads(zlib.decompress(self.bodies)))
+
+    def __str__(self):
+        return f'Page {self.page_number} of {self.game}'
+
+
 class Vote(models.Model):
     post = models.ForeignKey(Post, related_name='votes', db_index=True, on_delete=models.CASCADE)
     game = models.ForeignKey(Game, related_name='votes', db_index=True, on_delete=models.CASCADE)
@@ -393,10 +546,43 @@ class GameDay(models.Model):
     day_number = models.IntegerField(default=1)
     start_post = models.ForeignKey(Post, on_delete=models.CASCADE)
     notified = models.BooleanField(default=False)
+    # VoteCounter's saved state after applying every forum vote up to tally_vote_id
+    tally = models.TextField(blank=True, default='')
+    tally_vote_id = models.IntegerField(default=0)
+    # goes up on every invalidation, so a count that started before one can't save its tally over it
+    tally_generation = models.IntegerField(default=0)
 
     def __str__(self):
         return f'Day {self.day_number} of {self.game}'
 
+    @classmethod
+    def invalidate_tallies(cls, game_id):
+        cls.objects.filter(game_id=game_id).update(tally='', tally_vote_id=0,
+                                                   tally_generation=models.F('tally_generation') + 1)
+
+
+class UpdaterNode(models.Model):
+    # a running autoupdated process; it's alive while heartbeat_at is recent, and the totals are its throughput
+    name = models.CharField(max_length=64, unique=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    games_updated = models.IntegerField(default=0)
+    updates_failed = models.IntegerField(default=0)
+    update_seconds = models.FloatField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class UpdaterLease(models.Model):
+    # the autoupdated node looking after a game; another node may take it over once expires_at has passed
+    game = models.OneToOneField(Game, primary_key=True, related_name='updater_lease', on_delete=models.CASCADE)
+    node = models.CharField(max_length=64, blank=True, default='')
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.game} ({self.node or "unclaimed"})'
+
 
 class CookieStore(models.Model):
     cookie = models.TextField()
@@ -446,3 +632,29 @@ class ExecutionMessage(models.Model):
 
     def __str__(self):
         return self.text
+
+
+@receiver([post_save, post_delete], sender=Vote)
+@receiver([post_save, post_delete], sender=PlayerState)
+@receiver([post_save, post_delete], sender=GameDay)
+def invalidate_changed_tallies(sender, instance, raw=False, **kwargs):
+    # Votes, players and days changed one at a time, whether in a view, the admin or a shell, can change what
+    # the saved tallies already hold. Ingest stores its votes in bulk, which sends no signals, and the tally
+    # picks those up by itself; manual votes are never part of a tally.
+    if raw or (sender is Vote and instance.manual):
+        return
+    GameDay.invalidate_tallies(instance.game_id)
+
+
+@receiver([post_save, post_delete], sender=Vote)
+@receiver([post_save, post_delete], sender=PlayerState)
+@receiver([post_save, post_delete], sender=GameDay)
+@receiver([post_save, post_delete], sender=GameFaction)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=GameStatusUpdate)
+def bump_changed_games(sender, instance, raw=False, **kwargs):
+    # Everything a game's pages and votecount are worked out from, changed one row at a time. Ingest
+    # writes in bulk, without signals, and bumps the version itself; so do other bulk UPDATEs.
+    if raw:
+        return
+    Game.objects.filter(id=instance.game_id).update(version=models.F('version') + 1)
@@ -3,6 +3,6 @@ from django import template
 register = template.Library()
 
 @register.inclusion_tag("votecount.html")
-def votecount_html(vc):
-    return vc.game_state
+def votecount_html(game_context):
+    return game_context.game_state
 
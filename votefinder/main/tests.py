@@ -5,7 +5,32 @@ These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
+import io
+import random
+import string
+import tempfile
+import time
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+import simplejson
+from bs4 import BeautifulSoup
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.template import Context, Template
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from votefinder.main.models import (Alias, Comment, CookieStore, Game, Player, PlayerState, Post, UpdaterLease,
+                                    UpdaterNode, Vote, VotecountTemplate)
+
+from votefinder.main import (AutoUpdater, BNRPageParser, GameContext, GameReplayer, PageArchive, PostBodySerializer,
+                             SAForumPageDownloader, SAPageParser, VoteCounter, VotecountFormatter, VoteResolver, views,
+                             votecount_image_generation)
+
+from PIL import Image, ImageDraw
+from requests.cookies import create_cookie
 
 
 class SimpleTest(TestCase):
@@ -14,6 +39,622 @@ class SimpleTest(TestCase):
         self.assertEqual(1 + 1, 2)
 
 
+SELECTED = ' selected="selected"'
+
+
+def post_html(post_id, user_id, name, body):
+    # one post as it appears on an SA thread page
+    return (f'<table class="post" id="post{post_id}"><tr><td class="userinfo"><dl class="userinfo">'
+            f'<dt class="author">{name}</dt><dd class="title"><img src="https://example.com/{user_id}.png"></dd>'
+            f'</dl></td><td class="postbody">{body}</td></tr><tr><td class="postdate"><a href="#post{post_id}">#</a>'
+            f'<a href="/showthread.php?threadid=1&amp;userid={user_id}">?</a> Jan 05, 2024 14:{post_id % 60:02}'
+            '</td></tr></table>')
+
+
+def page_html(page, max_pages, posts):
+    options = ''.join(f'<option value="{number}"{SELECTED if number == page else ""}>{number}</option>'
+                      for number in range(1, max_pages + 1))
+    return (f'<html><head><title>Test Mafia - The Something Awful Forums</title></head><body>'
+            f'<div class="pages top"><select>{options}</select></div>{"".join(posts)}</body></html>')
+
+
+class IngestTestCase(TestCase):
+    fixtures = ['init.json']
+    thread_id = 1
+
+    def setUp(self):
+        cache.clear()  # game ids start over in every test, and so would the cache keys built from them
+        self.user = User.objects.create_user('tester')
+        self.next_post_id = 1000
+        # the moderator's opening post, with everyone who signs up on it joining the game
+        self.game = self.read_page(1, [(1, 'Moderator', 'Sign up here')], new_game=True)
+
+    def read_page(self, page, posts, new_game=False):
+        page_parser = SAPageParser.SAPageParser(offline=True)
+        page_parser.user = self.user
+        page_parser.new_game = new_game
+        page_parser.state = 'pregame'
+        post_nodes = []
+        for user_id, name, body in posts:
+            self.next_post_id += 1
+            post_nodes.append(post_html(self.next_post_id, user_id, name, body))
+        return page_parser.parse_page(page_html(page, 10, post_nodes), self.thread_id)
+
+
+class PageIngestTest(IngestTestCase):
+    def page_posts(self, count, first_user_id):
+        return [(first_user_id + number, f'Player{first_user_id + number}', f'<b>##vote Player{first_user_id}</b>')
+                for number in range(count)]
+
+    def test_query_count_does_not_depend_on_posts_per_page(self):
+        with CaptureQueriesContext(connection) as small_page:
+            self.read_page(2, self.page_posts(10, 100))
+        self.assertEqual(Post.objects.filter(game=self.game).count(), 11)
+        with self.assertNumQueries(len(small_page.captured_queries)):
+            self.read_page(3, self.page_posts(40, 200))
+        self.assertEqual(Post.objects.filter(game=self.game).count(), 51)
+
+    def test_renamed_players_keep_their_player(self):
+        self.read_page(2, [(100, 'Old Name', 'Hello')])
+        self.read_page(3, [(100, 'New Name', 'Hello again')])
+        authors = set(Post.objects.filter(game=self.game, author__sa_uid=100).values_list('author__name', flat=True))
+        self.assertEqual(authors, {'New Name'})
+
+
+def bnr_post(post_id, user_id, name, message):
+    # one post as the BNR API returns it
+    return {'post_id': post_id, 'message': message, 'post_date': 1704463200 + post_id,
+            'User': {'user_id': user_id, 'username': name, 'avatar_urls': {'o': f'https://example.com/{user_id}.png'}}}
+
+
+def bnr_thread(page, last_page, posts):
+    return {'thread': {'title': 'Test Mafia'}, 'pagination': {'current_page': page, 'last_page': last_page},
+            'posts': posts}
+
+
+class BNRPageIngestTest(TestCase):
+    fixtures = ['init.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('tester')
+        self.next_post_id = 1000
+        self.game = self.read_page(1, [(1, 'Moderator', 'Sign up here')], new_game=True)
+
+    def read_page(self, page, posts, new_game=False):
+        page_parser = BNRPageParser.BNRPageParser(offline=True)
+        page_parser.user = self.user
+        page_parser.new_game = new_game
+        page_parser.state = 'pregame'
+        thread_posts = []
+        for user_id, name, message in posts:
+            self.next_post_id += 1
+            thread_posts.append(bnr_post(self.next_post_id, user_id, name, message))
+        return page_parser.parse_page(bnr_thread(page, 10, thread_posts), 1)
+
+    def page_posts(self, count, first_user_id):
+        return [(first_user_id + number, f'Player{first_user_id + number}', f'[b]##vote Player{first_user_id}[/b]')
+                for number in range(count)]
+
+    def test_posts_players_and_votes_are_stored(self):
+        self.read_page(2, [(100, 'Player100', 'In'), (101, 'Player101', '[b]##vote player100[/b]'),
+                           (102, 'Player102', 'Me too [b]##vote Player100[/b]')])
+        self.assertEqual(self.game.home_forum, 'bnr')
+        self.assertEqual(Post.objects.filter(game=self.game).count(), 4)
+        self.assertEqual(set(self.game.players.filter(alive=True).values_list('player__bnr_uid', flat=True)),
+                         {100, 101, 102})
+        self.assertEqual(list(Vote.objects.filter(game=self.game).values_list('target__name', flat=True)),
+                         ['Player100'] * 2)
+
+    def test_query_count_does_not_depend_on_posts_per_page(self):
+        with CaptureQueriesContext(connection) as small_page:
+            self.read_page(2, self.page_posts(10, 100))
+        with self.assertNumQueries(len(small_page.captured_queries)):
+            self.read_page(3, self.page_posts(40, 200))
+        self.assertEqual(Post.objects.filter(game=self.game).count(), 51)
+
+
+class VoteResolverTest(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.read_page(2, [(100, 'Alice Smith', 'In'), (101, 'Bob Jones', 'In'), (102, 'Bobby Jones', 'In')])
+        self.players = {player.sa_uid: player for player in Player.objects.filter(sa_uid__gte=100)}
+
+    def resolver(self):
+        game = Game.objects.get(id=self.game.id)
+        return VoteResolver.VoteResolver(game, [state.player for state in game.all_players()])
+
+    def test_resolution_order(self):
+        outsider = Player.objects.create(name='Carol', sa_uid=103)
+        Alias.objects.create(player=self.players[101], alias='Robert')
+        Alias.objects.create(player=outsider, alias='Robert')
+        resolver = self.resolver()
+
+        self.assertEqual(resolver.resolve('alice SMITH'), self.players[100])
+        self.assertEqual(resolver.resolve('robert'), self.players[101])
+        # an alias of someone who has posted wins over one of someone who is only playing
+        resolver.load_players([outsider])
+        resolver.add_poster(outsider)
+        self.assertEqual(resolver.resolve('robert'), outsider)
+        self.assertEqual(resolver.resolve('Carol'), outsider)
+
+        self.assertEqual(resolver.resolve('smith'), self.players[100])
+        self.assertIsNone(resolver.resolve('jones'))  # part of two names
+        self.assertIsNone(resolver.resolve('bobb'))  # too short to go looking for
+        self.assertIsNone(resolver.resolve('nobody'))
+
+    def test_alias_changes_reach_the_cached_aliases(self):
+        self.resolver()
+        Alias.objects.create(player=self.players[100], alias='Al')
+        VoteResolver.VoteResolver.invalidate_player(self.players[100])
+        self.assertEqual(self.resolver().resolve('al'), self.players[100])
+
+    def test_roster_changes_reach_the_cached_aliases(self):
+        self.resolver()
+        newcomer = Player.objects.create(name='Dave', sa_uid=104)
+        Alias.objects.create(player=newcomer, alias='Davey')
+        PlayerState.objects.create(game=self.game, player=newcomer, alive=True)
+        self.game.bump_version()
+        self.assertEqual(self.resolver().resolve('davey'), newcomer)
+
+
+class EccoModeTest(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        Game.objects.filter(id=self.game.id).update(ecco_mode=True)
+        self.read_page(2, [(100, 'Alice', 'In'), (101, 'Bob', 'In'), (102, 'Carol', 'In')])
+
+    def alice_votes(self):
+        return list(Vote.objects.filter(author__sa_uid=100).values_list('target__name', 'unvote').order_by('id'))
+
+    def test_votes_stay_on_living_players(self):
+        # the second vote is turned away on the same page as the first, and again on a later page
+        self.read_page(3, [(100, 'Alice', '<b>##vote Bob</b>'), (100, 'Alice', '<b>##vote Carol</b>')])
+        self.read_page(4, [(100, 'Alice', '<b>##vote Carol</b>')])
+        self.assertEqual(self.alice_votes(), [('Bob', False)])
+
+    def test_votes_move_after_an_unvote_or_a_death(self):
+        self.read_page(3, [(100, 'Alice', '<b>##vote Bob</b>'), (100, 'Alice', '<b>##unvote</b>'),
+                           (100, 'Alice', '<b>##vote Carol</b>')])
+        PlayerState.objects.filter(game=self.game, player__sa_uid=102).update(alive=False)
+        self.read_page(4, [(100, 'Alice', '<b>##vote Bob</b>')])
+        self.assertEqual(self.alice_votes(), [('Bob', False), (None, True), ('Carol', False), ('Bob', False)])
+
+    def test_votes_from_before_the_day_started_dont_count(self):
+        self.read_page(3, [(100, 'Alice', '<b>##vote Bob</b>')])
+        self.read_page(4, [(101, 'Bob', 'Day two')])
+        self.game.days.update(start_post=Post.objects.filter(game=self.game).latest('id'))
+        self.read_page(5, [(100, 'Alice', '<b>##vote Carol</b>')])
+        self.assertEqual(self.alice_votes(), [('Bob', False), ('Carol', False)])
+
+
+class VoteCounterTest(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.read_page(2, [(user_id, f'Player{user_id}', 'In') for user_id in range(100, 104)])
+
+    def count(self):
+        vote_counter = VoteCounter.VoteCounter()
+        results = vote_counter.run(Game.objects.get(id=self.game.id))
+        return vote_counter, {result['target'].name: (result['count'], [(vote['author'].name, vote['unvote'], vote['enabled'])
+                                                                        for vote in result['votes']])
+                              for result in results}
+
+    def test_a_new_vote_switches_off_the_old_one(self):
+        self.read_page(3, [(100, 'Player100', '<b>##vote Player101</b>'), (100, 'Player100', '<b>##vote Player102</b>'),
+                           (100, 'Player100', '<b>##vote Player101</b>')])
+        vote_counter, results = self.count()
+        self.assertEqual(results['Player101'], (1, [('Player100', False, False), ('Player100', True, True),
+                                                    ('Player100', False, True)]))
+        self.assertEqual(results['Player102'], (0, [('Player100', False, False), ('Player100', True, True)]))
+        current = {author.name: target and target.name for author, target in vote_counter.currentVote.items()}
+        self.assertEqual(current, {'Player100': 'Player101', 'Player101': None, 'Player102': None, 'Player103': None})
+
+    def test_an_unvote_switches_off_the_oldest_live_vote(self):
+        self.read_page(3, [(100, 'Player100', '<b>##vote Player102</b>'), (101, 'Player101', '<b>##vote Player102</b>'),
+                           (100, 'Player100', '<b>##unvote</b>')])
+        vote_counter, results = self.count()
+        self.assertEqual(results['Player102'], (1, [('Player100', False, False), ('Player101', False, True),
+                                                    ('Player100', True, True)]))
+        self.assertIsNone(vote_counter.currentVote[Player.objects.get(name='Player100')])
+
+    def test_votes_on_dead_players_are_ignored(self):
+        PlayerState.objects.filter(game=self.game, player__name='Player103').update(alive=False)
+        self.read_page(3, [(100, 'Player100', '<b>##vote Player103</b>'), (103, 'Player103', '<b>##vote Player101</b>')])
+        vote_counter, results = self.count()
+        self.assertNotIn('Player103', results)
+        self.assertEqual(results['Player101'], (0, []))
+
+
+class VotecountTemplateTest(TestCase):
+    values = {'ticks': '⚪🟢', 'target': 'Bob & <Carol>', 'count': 1,
+              'votelist': '[url=https://example.com/?a=1&b=2]Alice[/url], "Dave"'}
+
+    def test_line_templates_render_like_the_template_engine(self):
+        for source in ('{{ ticks }} [b]{{target}}[/b] ({{ count }}): {{ votelist }}\n',
+                       '{{target}}{{target}} - no votelist\n',
+                       '{{ target|upper }} ({{ count }})\n',
+                       '{% if count %}{{ target }}{% endif %}\n',
+                       '{{ target }} {{ unknown }}\n'):
+            self.assertEqual(VotecountFormatter.LineTemplate(source).render(self.values),
+                             Template(source).render(Context(self.values)), source)
+
+    def test_compiled_templates_are_replaced_by_new_versions(self):
+        votecount_template = VotecountTemplate(id=1000, version=1, overall='{{ votecount }}',
+                                               single_line='{{ target }}', deadline_exists='{{ deadline }}')
+        compiled = VotecountFormatter.compile_template(votecount_template)
+        self.assertIs(VotecountFormatter.compile_template(votecount_template), compiled)
+
+        votecount_template.version = 2
+        votecount_template.single_line = '{{ target }} ({{ count }})'
+        recompiled = VotecountFormatter.compile_template(votecount_template)
+        self.assertEqual(recompiled['single_line'].render(self.values), 'Bob &amp; &lt;Carol&gt; (1)\n')
+        self.assertEqual(VotecountFormatter.compiled_templates[1000], (2, recompiled))
+
+        VotecountFormatter.forget_template(1000)
+        self.assertNotIn(1000, VotecountFormatter.compiled_templates)
+
+
+class VotecountImageTest(IngestTestCase):
+    def test_cached_images_answer_conditional_requests(self):
+        key = views.votecount_image_key(self.game.slug)
+        cached_image = views.cache_votecount_image(key, b'votecount', self.game.version)
+        url = f'/img/{self.game.slug}'
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response.content), (200, b'votecount'))
+        self.assertEqual(response['ETag'], cached_image['etag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=cached_image['etag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        # the same image drawn again keeps its Last-Modified; a different one gets a new ETag
+        self.assertEqual(views.cache_votecount_image(key, b'votecount', self.game.version)['last_modified'],
+                         cached_image['last_modified'])
+        views.cache_votecount_image(key, b'new votecount', self.game.version)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=cached_image['etag'])
+        self.assertEqual((response.status_code, response.content), (200, b'new votecount'))
+
+
+class VoteListWrapTest(TestCase):
+    def wrap_the_old_way(self, player_names, max_width):
+        # the vote list layout from before lines were measured one at a time: the whole text, every time
+        regular_font = votecount_image_generation.fonts()[0]
+        draw = votecount_image_generation.dummy_draw
+        text = player_names[0]
+        text_height = draw.multiline_textbbox((0, 0), text, font=regular_font)[3]
+        for player_name in player_names[1:]:
+            _, _, right, bottom = draw.multiline_textbbox((0, 0), f'{text}, {player_name}', font=regular_font)
+            if right > max_width:
+                text_height += bottom
+                text += f',\n{player_name}'
+            else:
+                text += f', {player_name}'
+        img = Image.new('RGB', (max_width, text_height + 4), (255, 255, 255))
+        ImageDraw.Draw(img).multiline_text((0, 0), text, fill=(0, 0, 0), font=regular_font)
+        return img
+
+    def test_vote_lists_wrap_exactly_as_before(self):
+        rng = random.Random(11)
+        for _ in range(25):
+            player_names = [''.join(rng.choice(string.ascii_letters + ' _-.gjpqy') for _ in range(rng.randint(2, 24)))
+                            for _ in range(rng.randint(1, 30))]
+            max_player_name_width = rng.randint(100, 700)
+            game_state = {'votecounts_by_player': [{
+                'player_name': 'Target', 'votes_received': len(player_names),
+                'votes': [{'author': name, 'enabled': True, 'unvote': False} for name in player_names]}]}
+            votecounts = {'Target': [None, None]}
+            votecount_image_generation.draw_vote_list(game_state, votecounts, max_player_name_width)
+            self.assertEqual(votecounts['Target'][1].tobytes(),
+                             self.wrap_the_old_way(player_names, 800 - max_player_name_width).tobytes(), player_names)
+
+
+class VotecountImageFormatTest(TestCase):
+    game_state = {
+        'gameday': 2, 'players': 5, 'to_execute': 3, 'deadline': 'May 1st', 'until_deadline': '2 hours',
+        'votecounts_by_player': [
+            {'player_name': 'Bob & <Carol>', 'votes_received': 2,
+             'votes': [{'author': 'Alice', 'enabled': True, 'unvote': False},
+                       {'author': 'Dave', 'enabled': False, 'unvote': False},
+                       {'author': 'Erin', 'enabled': True, 'unvote': False}]},
+            {'player_name': 'Alice', 'votes_received': 0, 'votes': []},
+        ],
+    }
+
+    def test_palette_pngs_match_the_full_colour_layout(self):
+        png = Image.open(io.BytesIO(votecount_image_generation.render_game_state(self.game_state, 'png')))
+        palette = Image.open(io.BytesIO(votecount_image_generation.render_game_state(self.game_state, 'palette')))
+        self.assertEqual(palette.size, png.size)
+        self.assertEqual(palette.mode, 'P')
+        self.assertLessEqual(len(palette.getcolors()), 4)
+
+    def test_svgs_hold_the_votecount_as_text(self):
+        svg = ElementTree.fromstring(votecount_image_generation.render_game_state(self.game_state, 'svg'))
+        lines = [text.text for text in svg.iter('{http://www.w3.org/2000/svg}text')]
+        self.assertEqual(lines, ['Votecount for Day 2', 'Bob & <Carol> (2): ', 'Alice, Erin',
+                                 "With 5 alive, it's 3 votes to execute.",
+                                 "The current deadline is May 1st - that's in about 2 hours."])
+        self.assertGreater(int(svg.get('height')), float(svg[-1].get('y')))
+
+
+class GameVersionTest(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.read_page(2, [(100, 'Player100', 'In'), (101, 'Player101', '<b>##vote Player100</b>')])
+
+    def version(self):
+        return Game.objects.values_list('version', flat=True).get(id=self.game.id)
+
+    def assertBumps(self, change):
+        version = self.version()
+        change()
+        self.assertGreater(self.version(), version)
+
+    def test_moderator_settings_and_factions_bump_the_version(self):
+        self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+        game_id = self.game.id
+        self.assertBumps(lambda: self.client.get(f'/post_executions/{game_id}/on'))
+        self.assertBumps(lambda: self.client.get(f'/ecco_mode/{game_id}/on'))
+        self.assertBumps(lambda: self.client.post(f'/add_faction/{game_id}', {'faction_name': 'Mafia', 'faction_type': 'scum'}))
+        faction_id = self.game.factions.get().id
+        self.assertBumps(lambda: self.client.get(f'/delete_faction/{faction_id}'))
+
+    def test_edits_outside_the_views_bump_the_version(self):
+        game = Game.objects.get(id=self.game.id)
+        player = Player.objects.get(sa_uid=100)
+        vote = Vote.objects.get(game=game)
+
+        def edit_vote():
+            vote.ignored = True
+            vote.save()
+
+        def kill_player():
+            player_state = PlayerState.objects.get(game=game, player=player)
+            player_state.alive = False
+            player_state.save()
+
+        def set_deadline():
+            game.deadline = datetime(2030, 1, 1)
+            game.save()
+
+        for change in (edit_vote, kill_player, set_deadline,
+                       lambda: Comment.objects.create(game=game, player=player, comment='Day ends soon'),
+                       lambda: Comment.objects.filter(game=game).delete(),
+                       lambda: game.status_update('Something happened')):
+            self.assertBumps(change)
+
+    def test_saves_that_change_nothing_shown_keep_the_version(self):
+        game = Game.objects.get(id=self.game.id)
+        version = self.version()
+        game.save()
+        game.page_fingerprint = 'abc'
+        game.save()
+        self.assertEqual(self.version(), version)
+
+
+class PolledPageTest(IngestTestCase):
+    def test_polled_pages_answer_with_304_until_the_game_changes(self):
+        url = f'/posts/{self.game.id}/1'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.read_page(1, [(100, 'Player100', 'In')])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Player100')
+
+    def test_game_lists_answer_with_304_until_a_game_changes(self):
+        Game.objects.filter(id=self.game.id).update(state='started')
+        response = self.client.get('/active_games/json/')
+        self.assertEqual(self.client.get('/active_games/json/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        game = Game.objects.get(id=self.game.id)
+        game.name = 'Renamed Mafia'
+        game.save()
+        response = self.client.get('/active_games/json/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, 'Renamed Mafia')
+
+
+class VoteTallyTest(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.read_page(2, [(user_id, f'Player{user_id}', 'In') for user_id in range(100, 106)])
+        self.read_page(3, [(100, 'Player100', '<b>##vote Player101</b>'), (102, 'Player102', '<b>##vote Player101</b>'),
+                           (103, 'Player103', '<b>##vote Player104</b>')])
+
+    def count_votes(self):
+        vote_counter = VoteCounter.VoteCounter()
+        results = vote_counter.run(Game.objects.get(id=self.game.id))
+        return ([(result['target'].name, result['count'],
+                  [(vote['author'].name, vote['unvote'], vote['enabled']) for vote in result['votes']])
+                 for result in results],
+                [(entry['player'], entry['count'], entry['text']) for entry in vote_counter.get_votelog()])
+
+    def test_incremental_tally_matches_rebuild(self):
+        self.count_votes()
+        gameday = self.game.days.get()
+        self.assertTrue(gameday.tally)
+
+        self.read_page(4, [(100, 'Player100', '<b>##unvote</b>'), (103, 'Player103', '<b>##vote Player101</b>'),
+                           (104, 'Player104', '<b>##vote Player100</b>'), (102, 'Player102', '<b>##vote Player105</b>')])
+        incremental = self.count_votes()
+        self.assertGreater(self.game.days.get().tally_vote_id, gameday.tally_vote_id)
+
+        Game.objects.get(id=self.game.id).invalidate_tally()
+        self.assertEqual(self.count_votes(), incremental)
+
+    def test_edits_throw_the_tally_away(self):
+        self.count_votes()
+        vote = Vote.objects.get(author__sa_uid=103)
+        vote.target = Player.objects.get(sa_uid=105)
+        vote.save()
+        self.assertEqual(self.game.days.get().tally, '')
+        counted = self.count_votes()
+        self.assertIn(('Player105', 1, [('Player103', False, True)]), counted[0])
+
+        Vote.objects.create(game=self.game, post=vote.post, author=vote.author, target=vote.target, manual=True)
+        self.assertTrue(self.game.days.get().tally)  # manual votes are counted on top of the tally
+
+    def test_count_started_before_an_invalidation_keeps_its_tally_to_itself(self):
+        game = Game.objects.get(id=self.game.id)
+        game_context = GameContext.GameContext(game)
+        self.assertIsNotNone(game_context.gameday)  # read when the count starts
+        game.invalidate_tally()
+        VoteCounter.VoteCounter().run(game, context=game_context)
+        gameday = self.game.days.get()
+        self.assertEqual((gameday.tally, gameday.tally_vote_id), ('', 0))
+
+
+class GameLeaseTest(IngestTestCase):
+    def test_game_lease_cycle(self):
+        token = self.game.acquire_lease()
+        self.assertIsNotNone(token)
+        self.assertIsNone(Game.objects.get(id=self.game.id).acquire_lease())
+        self.assertTrue(self.game.renew_lease(token))
+
+        # once it runs out, someone else can take it and the old holder can't renew it
+        Game.objects.filter(id=self.game.id).update(
+            locked_at=datetime.now() - timedelta(seconds=Game.LEASE_SECONDS + 1))
+        other = Game.objects.get(id=self.game.id)
+        other_token = other.acquire_lease()
+        self.assertIsNotNone(other_token)
+        self.assertFalse(self.game.renew_lease(token))
+
+        self.game.release_lease(token)  # not ours any more, so nothing happens
+        self.assertIsNone(self.game.acquire_lease())
+        other.release_lease(other_token)
+        self.assertIsNotNone(self.game.acquire_lease())
+
+
+class NodeLeaseTest(IngestTestCase):
+    def test_node_leases_are_taken_over_when_they_expire(self):
+        open_ids = {self.game.id}
+        first_node = AutoUpdater.NodeLeases('first', lease_seconds=60, batch_size=10)
+        second_node = AutoUpdater.NodeLeases('second', lease_seconds=60, batch_size=10)
+        # a newly opened game gets its lease on one sweep and can be claimed from the next
+        self.assertEqual(first_node.claim(open_ids, set()), set())
+        self.assertEqual(first_node.claim(open_ids, set()), open_ids)
+        self.assertEqual(second_node.claim(open_ids, set()), set())
+        self.assertEqual(first_node.claim(open_ids, set()), open_ids)  # renewed
+
+        expired = datetime.now() - timedelta(seconds=61)
+        UpdaterNode.objects.filter(name='first').update(heartbeat_at=expired)
+        UpdaterLease.objects.filter(node='first').update(expires_at=expired)
+        self.assertEqual(second_node.claim(open_ids, set()), open_ids)
+        self.assertEqual(UpdaterLease.objects.get(game=self.game).node, 'second')
+
+
+class ForumSessionTest(TestCase):
+    def stored_cookies(self):
+        stored = CookieStore.objects.filter(id=SAForumPageDownloader.SA_COOKIE_STORE_ID).first()
+        return stored and {cookie['name']: cookie['value'] for cookie in simplejson.loads(stored.cookie)}
+
+    def test_logins_are_shared_through_the_cookie_store(self):
+        first = SAForumPageDownloader.ForumSession()
+        first.get().cookies.set_cookie(create_cookie('bbuserid', '42', domain='.somethingawful.com',
+                                                     expires=int(time.time()) + 3600))
+        first.save_cookies()
+        self.assertEqual(self.stored_cookies(), {'bbuserid': '42'})
+
+        second = SAForumPageDownloader.ForumSession()
+        self.assertEqual(second.get().cookies.get('bbuserid'), '42')
+        self.assertFalse(second.load_cookies())  # nothing new since
+
+        # turned down by the forum, so they're dropped for everyone
+        second.forget_cookies()
+        self.assertEqual(len(second.session.cookies), 0)
+        self.assertIsNone(self.stored_cookies())
+
+    def test_expired_cookies_are_dropped(self):
+        cookie = {'name': 'bbuserid', 'value': '42', 'domain': '.somethingawful.com', 'path': '/',
+                  'expires': int(time.time()) - 60, 'secure': True}
+        CookieStore.objects.create(id=SAForumPageDownloader.SA_COOKIE_STORE_ID, cookie=simplejson.dumps([cookie]))
+        self.assertEqual(len(SAForumPageDownloader.ForumSession().get().cookies), 0)
+        self.assertIsNone(self.stored_cookies())
+
+
+class PageFingerprintTest(IngestTestCase):
+    def update(self, posts, game=None):
+        page_parser = SAPageParser.SAPageParser(offline=True)
+        page_parser.user = self.user
+        page = page_html(2, 10, [post_html(post_id, user_id, f'Player{user_id}', body) for post_id, user_id, body in posts])
+        page_parser.download_forum_page = lambda url: page
+        return page_parser.update(game or Game.objects.get(id=self.game.id))
+
+    def test_pages_seen_before_are_not_parsed_again(self):
+        posts = [(2001, 100, 'In'), (2002, 101, 'In')]
+        self.update(posts)
+        self.assertEqual(self.game.posts.count(), 3)
+
+        game = Game.objects.get(id=self.game.id)
+        with self.assertNumQueries(0):
+            self.assertIs(self.update(posts, game), game)
+
+        self.update([*posts, (2003, 102, '<b>##vote Player100</b>')])
+        self.assertEqual(self.game.posts.count(), 4)
+        self.assertTrue(Vote.objects.filter(game=self.game, author__sa_uid=102, target__sa_uid=100).exists())
+
+
+class PostBodyTest(TestCase):
+    body = ('<td class="postbody">\n  Hello   <b>there</b> &amp; a &lt;tag&gt;\n<!-- google_ad_section_start -->'
+            '<script>alert(1)</script><a href="javascript:alert(1)" onclick="alert(1)">link</a>'
+            '<img src="https://example.com/a.png?x=1&amp;y=2"><pre>  kept\n  as is</pre>\n</td>')
+
+    def serialize(self, body):
+        return PostBodySerializer.PostBodySerializer().serialize(BeautifulSoup(body, 'html.parser').td or
+                                                                  BeautifulSoup(body, 'html.parser'))
+
+    def test_serializer(self):
+        body = self.serialize(self.body)
+        self.assertEqual(body, 'Hello <b>there</b> &amp; a &lt;tag&gt; <a>link</a><div class="embedded-image '
+                               'not-loaded" data-image="https://example.com/a.png?x=1&amp;y=2">Click to load '
+                               'image...</div><pre>  kept\n  as is</pre>')
+        self.assertEqual(self.serialize(body), body)
+
+
+class PostArchiveTest(IngestTestCase):
+    def test_archived_bodies_round_trip(self):
+        self.read_page(2, [(100, 'Player100', PostBodyTest.body), (101, 'Player101', 'Second post')])
+        bodies = dict(Post.objects.filter(game=self.game).values_list('post_id', 'body'))
+        self.game.archive_post_bodies()
+        self.assertEqual(set(Post.objects.filter(game=self.game).values_list('body', flat=True)), {''})
+        self.assertEqual({post_id: body for archive in self.game.post_archives.all()
+                          for post_id, body in archive.unpack().items()}, bodies)
+        self.assertContains(self.client.get(f'/posts/{self.game.id}/2'), 'Second post')  # read from the archive
+
+        self.game.restore_post_bodies()
+        self.assertEqual(dict(Post.objects.filter(game=self.game).values_list('post_id', 'body')), bodies)
+
+
+class GameReplayTest(IngestTestCase):
+    def setUp(self):
+        # every page read in these tests goes into an archive of their own
+        archive_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_directory.cleanup)
+        self.addCleanup(setattr, PageArchive, 'page_archive', PageArchive.page_archive)
+        PageArchive.page_archive = PageArchive.PageArchive(archive_directory.name)
+        super().setUp()
+        self.read_page(2, [(100, 'Player100', 'In'), (101, 'Player101', '<b>##vote Player100</b>'),
+                           (102, 'Player102', '<b>##vote Player101</b>')])
+
+    def forum_votes(self):
+        return set(Vote.objects.filter(game=self.game, manual=False).values_list(
+            'author__sa_uid', 'target__sa_uid', 'ignored'))
+
+    def test_replays_rebuild_posts_and_votes_from_the_archive(self):
+        Vote.objects.filter(game=self.game, author__sa_uid=102).update(ignored=True)
+        Post.objects.filter(game=self.game, author__sa_uid=100).update(body='Garbled')
+        Post.objects.filter(game=self.game, author__sa_uid=101).delete()
+
+        replayer = GameReplayer.GameReplayer(Game.objects.get(id=self.game.id), PageArchive.page_archive)
+        self.assertEqual(replayer.run(), (2, 4, 1, 2))
+        self.assertEqual(self.forum_votes(), {(101, 100, False), (102, 101, True)})  # still ignored
+        self.assertEqual(Post.objects.get(game=self.game, author__sa_uid=100).body, 'In')
+        self.assertEqual(self.game.posts.count(), 4)
+
+
 __test__ = {'doctest': """
 Another way to test that 1 + 1 is equal to 2.
 
@@ -1,10 +1,14 @@
+import hashlib
 import json as simplejson
-import math
 import random
 import requests
 import urllib
 import re
+import threading
+import time
 
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from math import ceil
 
@@ -14,14 +18,16 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
-from django.db import connections
-from django.db.models import Max, Min, Q  # noqa: WPS347
+from django.db import close_old_connections, connections
+from django.db.models import F, Max, Min, Q  # noqa: WPS347
 from django.http import (HttpResponse, HttpResponseForbidden,
                          HttpResponseNotFound, HttpResponseRedirect)
 from django.shortcuts import get_list_or_404, get_object_or_404, render, redirect
 from django.template.context_processors import csrf
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
 
-from PIL import Image
 from votefinder.main.models import (AddCommentForm, AddFactionForm, AddPlayerForm,  # noqa: WPS235
                                     Alias, BlogPost, Comment, Game, GameDay,
                                     GameFaction, GameStatusUpdate, Player,
@@ -29,14 +35,21 @@ from votefinder.main.models import (AddCommentForm, AddFactionForm, AddPlayerFor
                                     VotecountTemplate, VotecountTemplateForm)
 
 from votefinder.main import (SAForumPageDownloader, SAGameListDownloader, SAPageParser,
-                             VoteCounter, VotecountFormatter, BNRGameListDownloader,
-                             BNRPageParser, BNRApi)
+                             BNRGameListDownloader, BNRPageParser, BNRApi, VoteResolver,
+                             GameContext, VotecountFormatter, ImageRenderer)
 
-from .votecount_image_generation import votecount_to_image
+from .votecount_image_generation import IMAGE_FORMATS, render_game_state
 
 import logging
 logger = logging.getLogger(__name__)
 
+# finished votecount images stay cached this long; they are refreshed in the background well before then
+VOTECOUNT_IMAGE_CACHE_SECONDS = 60 * 60 * 24
+
+image_refresh_executor = ThreadPoolExecutor(max_workers=settings.VF_IMAGE_REFRESH_WORKERS)
+image_refreshes = {}
+image_refresh_lock = threading.Lock()
+
 
 def check_mod(request, game):
     try:
@@ -45,6 +58,39 @@ def check_mod(request, game):
         return False
 
 
+# ETags for the pages that get polled, worked out from game versions alone so that a client
+# with a fresh copy gets its 304 before the page does any real work. Returning None skips the check.
+def game_etag(request, games, clock=False):
+    game = games.values_list('id', 'version').first()
+    if game is None or len(messages.get_messages(request)):
+        return None
+    parts = [*game, request.user.pk or 0]
+    if clock:
+        parts.append(datetime.now().strftime('%Y%m%d%H%M'))  # pages that say how long ago things were
+    return '-'.join(str(part) for part in parts)
+
+
+def game_list_etag(games, clock=False):
+    parts = [f'{game_id}.{version}' for game_id, version in games.order_by('id').values_list('id', 'version')]
+    if clock:
+        parts.append(datetime.now().strftime('%Y%m%d%H%M'))
+    return hashlib.sha1('-'.join(parts).encode()).hexdigest()  # noqa: S324
+
+
+def game_page_etag(request, slug):
+    return game_etag(request, Game.objects.filter(slug=slug), clock=True)
+
+
+def posts_etag(request, gameid, page):
+    return game_etag(request, Game.objects.filter(id=gameid))
+
+
+def active_games_etag(request, style='default'):
+    if style == 'closedmonthly':
+        return game_list_etag(Game.objects.filter(state='closed'), clock=True)
+    return game_list_etag(Game.objects.filter(state='started'))
+
+
 def index(request):
     active_game_list = Game.objects.select_related().filter(state='started').order_by('name')
     pregame_list = Game.objects.select_related().filter(state='pregame').order_by('name')
@@ -135,9 +181,11 @@ def game_list(request, page):
     return HttpResponse(simplejson.dumps(downloader.GameList), content_type='application/json')
 
 
+@condition(etag_func=game_page_etag)
 def game(request, slug):
     game = get_object_or_404(Game, slug=slug)
-    players = game.players.select_related().all()
+    game_context = GameContext.GameContext(game, request)
+    players = game_context.player_states
     form = AddPlayerForm()
     try:
         comment = Comment.objects.get(game=game)
@@ -145,19 +193,20 @@ def game(request, slug):
     except Comment.DoesNotExist:
         comment_form = AddCommentForm()
     faction_form = AddFactionForm()
-    moderators = [ps.player for ps in game.moderators()]
+    moderators = [ps.player for ps in game_context.moderators]
     templates = VotecountTemplate.objects.select_related().filter(Q(creator__in=moderators) | Q(shared=True))
     updates = GameStatusUpdate.objects.filter(game=game).order_by('-timestamp')
 
-    gameday = game.days.select_related().last()
+    gameday = game_context.gameday
 
     # detecting games that are missing posts
     if gameday is None:
-        context = {'game': game, 'players': players, 'moderator': check_mod(request, game), 'form': form,
+        context = {'game': game, 'players': players, 'moderator': game_context.is_moderator, 'form': form,
                    'comment_form': comment_form, 'broken': True}
         return render(request, 'game_broken.html', context)
 
-    manual_votes = Vote.objects.filter(game=game, manual=True, post__id__gte=gameday.start_post.id).order_by('id')
+    manual_votes = Vote.objects.select_related('author', 'target').filter(
+        game=game, manual=True, post__id__gte=gameday.start_post_id).order_by('id')
 
     if game.deadline:
         tz = timezone(game.timezone)
@@ -167,45 +216,38 @@ def game(request, slug):
         deadline = timezone(game.timezone).localize(datetime.now() + timedelta(days=3))
         tzone = game.timezone
 
+    player_state = False
     if request.user.is_authenticated:
         try:
-            player_state = PlayerState.objects.get(game=game, player=request.user.profile.player)
+            player_id = request.user.profile.player_id
         except UserProfile.DoesNotExist:
-            player_state = False
-        except PlayerState.DoesNotExist:
-            player_state = False
-    else:
-        player_state = False
+            player_id = None
+        player_state = next((ps for ps in players if ps.player_id == player_id), False)
 
-    post_vc_button = bool(check_mod(request, game) and (game.last_vc_post is None or datetime.now() - game.last_vc_post >= timedelta(minutes=60) or (game.deadline and game.deadline - datetime.now() <= timedelta(minutes=60))))
-
-    vc_formatter = VotecountFormatter.VotecountFormatter(game)
-    vc_formatter.go()
+    post_vc_button = bool(game_context.is_moderator and (game.last_vc_post is None or datetime.now() - game.last_vc_post >= timedelta(minutes=60) or (game.deadline and game.deadline - datetime.now() <= timedelta(minutes=60))))
 
     ## determining if there are unresolved votes
 
     unresolved_votes = game.get_unresolved_votes()
 
     if settings.VF_DEBUG == True:
-        bbcode = vc_formatter.get_bbcode()
-        logger.debug(bbcode)
+        logger.debug(game_context.bbcode)
 
-    context = {'game': game, 'players': players.order_by("player__name"), 'moderator': check_mod(request, game), 'form': form,
+    context = {'game': game, 'players': players, 'moderator': game_context.is_moderator, 'form': form,
                'comment_form': comment_form, 'gameday': gameday, 'post_vc_button': post_vc_button,
                'nextDay': gameday.day_number + 1, 'deadline': deadline, 'templates': templates,
                'manual_votes': manual_votes, 'timezone': tzone, 'common_timezones': common_timezones,
-               'updates': updates, 'playerstate': player_state, 'faction_form': faction_form, 'broken': False, 'vc': vc_formatter, 'bbcode_votecount': vc_formatter.get_bbcode(), 'unresolved_votes': unresolved_votes}
+               'updates': updates, 'playerstate': player_state, 'faction_form': faction_form, 'broken': False, 'game_context': game_context, 'bbcode_votecount': game_context.bbcode, 'unresolved_votes': unresolved_votes}
     return render(request, 'game.html', context)
 
 
 def update(request, gameid):
     game = get_object_or_404(Game, id=gameid)
-    if game.is_locked():
+    lease = game.acquire_lease()
+    if lease is None:
         return HttpResponse(simplejson.dumps(
             {'success': False, 'message': 'Someone else is updating that game right now.  Please wait.'}),
             content_type='application/json')
-    else:
-        game.lock()
     try:
         if game.home_forum == 'bnr':
             page_parser = BNRPageParser.BNRPageParser()
@@ -216,12 +258,10 @@ def update(request, gameid):
             return HttpResponse(
                 simplejson.dumps({'success': True, 'curPage': new_game.current_page, 'maxPages': new_game.max_pages}),
                 content_type='application/json')
-        game.save()
         return HttpResponse(simplejson.dumps({'success': False, 'message': 'There was a problem either downloading or parsing the forum page.  Please try again later.'}),
                             content_type='application/json')
-    except BaseException:
-        game.save()
-        raise
+    finally:
+        game.release_lease(lease)
 
 
 @login_required
@@ -313,6 +353,10 @@ def claim_player(request, playerid):
                     Post.objects.filter(author=player).update(author=request.user.profile.player)
                     Vote.objects.filter(target=player).update(target=request.user.profile.player)
                     Vote.objects.filter(author=player).update(author=request.user.profile.player)
+                    VoteResolver.VoteResolver.invalidate_player(request.user.profile.player)
+                    GameDay.objects.filter(game__players__player=request.user.profile.player).update(
+                        tally='', tally_vote_id=0, tally_generation=F('tally_generation') + 1)
+                    Game.objects.filter(players__player=request.user.profile.player).update(version=F('version') + 1)
                     if player.sa_uid is not None:
                         request.user.profile.player.sa_uid = player.sa_uid
                     elif player.bnr_uid is not None:
@@ -488,9 +532,7 @@ def resolve(request, voteid, resolution):
         alias, created = Alias.objects.get_or_create(player=player, alias=vote.target_string)
         if created:
             alias.save()
-
-    key = f'{vote.game.slug}-vc-image'
-    cache.delete(key)
+            VoteResolver.VoteResolver.invalidate_player(player)  # aliases apply in every game the player is in
 
     new_votes = Vote.objects.filter(game=vote.game, target_string__iexact=vote.target_string, target=None, unvote=False,
                                     ignored=False, no_execute=False)
@@ -499,10 +541,13 @@ def resolve(request, voteid, resolution):
     return HttpResponse(simplejson.dumps({'success': True, 'refresh': refresh}))
 
 
+@condition(etag_func=posts_etag)
 def posts(request, gameid, page):
     game = get_object_or_404(Game, id=gameid)
-    posts = game.posts.select_related().filter(page_number=page).order_by('id')
     page = int(page)
+    posts = list(game.posts.select_related().filter(page_number=page).order_by('id'))
+    if any(not post.body for post in posts):
+        read_archived_bodies(game, page, posts)
     gameday = game.days.select_related().last()
     context = {'game': game, 'posts': posts,
                'prevPage': page - 1, 'nextPage': page + 1, 'page': page,
@@ -511,6 +556,15 @@ def posts(request, gameid, page):
     return render(request, 'posts.html', context)
 
 
+def read_archived_bodies(game, page, posts):
+    # bodies of a closed game's posts are kept compressed, a page at a time
+    archive = game.post_archives.filter(page_number=page).first()
+    if archive is not None:
+        bodies = archive.unpack()
+        for post in posts:
+            post.body = post.body or bodies.get(post.post_id, '')
+
+
 @login_required
 def start_game(request, gameid, day):
     game = get_object_or_404(Game, id=gameid)
@@ -600,6 +654,7 @@ def close_game(request, gameid):
         faction.save()
     game.state = 'closed'
     game.save()
+    game.archive_post_bodies()
     if faction is not None:
         game.status_update(f'The game is over. {faction.faction_name} has won.')
     else:
@@ -617,6 +672,7 @@ def reopen_game(request, gameid):
     if game.state != 'closed' or not check_mod(request, game):
         return HttpResponseNotFound
 
+    game.restore_post_bodies()
     game.state = 'started'
     game.save()
 
@@ -761,7 +817,10 @@ def edit_template(request, templateid):
         new_temp.id = old_temp.id  # noqa: WPS125
         new_temp.creator = old_temp.creator
         new_temp.system_default = old_temp.system_default
+        new_temp.version = old_temp.version
         new_temp.save()
+        VotecountFormatter.forget_template(new_temp.id)
+        games_using(new_temp).update(version=F('version') + 1)
 
         if old_temp.shared and not new_temp.shared:
             player = request.user.profile.player
@@ -791,12 +850,21 @@ def delete_template(request, templateid):
         this_game.template = None
         this_game.save()
 
+    VotecountFormatter.forget_template(template.id)
+    games_using(template).update(version=F('version') + 1)
     template.delete()
 
     messages.add_message(request, messages.SUCCESS, 'Template was deleted!')
     return HttpResponseRedirect('/templates')
 
 
+def games_using(template):
+    # games without a template of their own show the system default
+    if template.system_default:
+        return Game.objects.filter(Q(template=template) | Q(template=None))
+    return Game.objects.filter(template=template)
+
+
 @login_required
 def game_template(request, gameid, templateid):
     game = get_object_or_404(Game, id=gameid)
@@ -812,6 +880,7 @@ def game_template(request, gameid, templateid):
     return HttpResponseRedirect(game.get_absolute_url())
 
 
+@condition(etag_func=active_games_etag)
 def active_games(request):
     game_list = Game.objects.select_related().filter(state='started').order_by('name')
 
@@ -822,6 +891,7 @@ def active_games(request):
                   {'big_games': big_games, 'mini_games': mini_games})
 
 
+@condition(etag_func=active_games_etag)
 def active_games_style(request, style):
     if style in {'default', 'verbose'}:
         game_list = Game.objects.select_related().filter(state='started').order_by('name')
@@ -838,10 +908,11 @@ def active_games_style(request, style):
     return HttpResponse('Style not supported')
 
 
+@condition(etag_func=active_games_etag)
 def active_games_json(request):
     game_list = sorted(({'name': game.name, 'mod': game.moderator.name,
                         'url': f'http://forums.somethingawful.com/showthread.php?threadid={game.thread_id}'} for game in
-                       Game.objects.select_related().filter(state='started')), key=lambda game_name: game['name'])
+                       Game.objects.select_related().filter(state='started')), key=lambda game_name: game_name['name'])
 
     return HttpResponse(simplejson.dumps(game_list), content_type='application/json')
 
@@ -902,69 +973,197 @@ def delete_vote(request, voteid):
     return HttpResponseRedirect(game.get_absolute_url())
 
 
-def check_update_game(game):
-    if game.is_locked():
+def check_update_game(game, catch_up=False):
+    # reads any new posts into the game, unless someone else is already doing it
+    lease = game.acquire_lease()
+    if lease is None:
         return game
-    else:
-        game.lock()
+    try:
+        return read_new_posts(game, lease, catch_up)
+    finally:
+        game.release_lease(lease)
 
+
+def read_new_posts(game, lease, catch_up=False):
+    # Requests only ever read the next page; catching up on every missing page can take a while,
+    # so that's left to the autoupdater.
     try:
         if game.home_forum == 'sa':
             page_parser = SAPageParser.SAPageParser()
         elif game.home_forum == 'bnr':
             page_parser = BNRPageParser.BNRPageParser()
-        new_game = page_parser.update(game)
+        if catch_up:
+            new_game = page_parser.catch_up(game, lease=lease)
+        else:
+            new_game = page_parser.update(game)
         if new_game:
             return new_game
-        game.save()
         return game
-    except BaseException:
+    except Exception:
+        logger.exception(f'Could not read new posts into {game.slug}')
         return game
 
 
 def votecount_image(request, slug):
     game = get_object_or_404(Game, slug=slug)
+    image_format = request.GET.get('format', 'png')
+    if image_format not in IMAGE_FORMATS:
+        return HttpResponseNotFound()
+    content_type = IMAGE_FORMATS[image_format][1]
 
     if settings.DEBUG == True:
         print("Debug - testing image generation")
         # skip all the caching and just generate a fresh image for testing
         game = check_update_game(game)
-        img = votecount_to_image(game)
-        response = HttpResponse(content_type='image/png')
-        img.save(response, 'PNG')  # transparency=(255, 255, 255))
-        return response
+        return HttpResponse(render_game_state(GameContext.GameContext(game).game_state, image_format),
+                            content_type=content_type)
 
     else:
-        key = f'{slug}-vc-image'
-        img_dict = cache.get(key)
+        key = votecount_image_key(slug, image_format)
+        cached_image = cache.get(key)
+
+        if cached_image is None:
+            # nothing to show yet, so this request waits a little while for the first render; if that takes
+            # longer, the render carries on without holding up the worker and the client is asked to come back
+            refresh = refresh_votecount_image(slug, image_format)
+            try:
+                if refresh is not None:
+                    cached_image = refresh.result(timeout=settings.VF_IMAGE_WAIT_SECONDS)
+                else:
+                    cached_image = wait_for_votecount_image(slug, image_format)
+            except (ImageRenderer.ImageRendererBusy, futures.TimeoutError):
+                response = HttpResponse('The votecount image is still being drawn.', status=503)
+                response['Retry-After'] = 5
+                return response
+        elif votecount_image_is_stale(cached_image, game):
+            refresh_votecount_image(slug, image_format)
+
+        response = get_conditional_response(request, etag=cached_image['etag'],
+                                            last_modified=cached_image['last_modified'])
+        if response is None:
+            response = HttpResponse(cached_image['data'], content_type=content_type)
+        response['ETag'] = cached_image['etag']
+        response['Last-Modified'] = http_date(cached_image['last_modified'])
+        return response
 
-        if img_dict is None:
-            game = check_update_game(game)
-            img = votecount_to_image(game)
-            cache.set(key, {'size': img.size, 'data': img.tobytes()}, 120)
-        else:
-            img = Image.frombytes('RGB', img_dict['size'], img_dict['data'])
 
-        response = HttpResponse(content_type='image/png')
-        img.save(response, 'PNG')  # transparency=(255, 255, 255))
-        return response
+def votecount_image_key(slug, image_format='png'):
+    return f'{slug}-vc-{image_format}'
 
 
-def autoupdate(request):
-    games = Game.objects.exclude(state='closed').order_by('-last_updated')
-    for game in games:
-        key = f'{game.slug}-vc-image'
-        cache.delete(key)  # image will regenerate on next GET
-        game = check_update_game(game)
-        post = game.posts.order_by('-timestamp')[:1][0]
+def votecount_image_is_stale(cached_image, game):
+    # redrawn once the game has moved on, or every so often anyway to keep the deadline countdown current
+    return (cached_image.get('version') != game.version
+            or time.time() - cached_image['rendered_at'] > settings.VF_IMAGE_REFRESH_SECONDS)
 
-        if datetime.now() - post.timestamp > timedelta(days=6) and game.state == 'started':
-            game.status_update('Closed automatically for inactivity.')
-            game.state = 'closed'
-            game.save()
+
+def refresh_votecount_image(slug, image_format='png'):
+    # Starts a background update and re-render of a game's image, unless one is already running. Requests
+    # in this process share the running refresh; the cache lock keeps other processes from starting their own.
+    # Returns the refresh, or None if another process is doing it.
+    key = votecount_image_key(slug, image_format)
+    with image_refresh_lock:
+        refresh = image_refreshes.get(key)
+        if refresh is None:
+            if not cache.add(f'{key}-refreshing', True, settings.VF_IMAGE_REFRESH_TIMEOUT):
+                return None
+            refresh = image_refresh_executor.submit(render_votecount_image, slug, image_format)
+            image_refreshes[key] = refresh
+    return refresh
+
+
+def render_votecount_image(slug, image_format):
+    key = votecount_image_key(slug, image_format)
+    try:
+        game = check_update_game(Game.objects.get(slug=slug))
+        return cache_votecount_image(key, draw_votecount_image(game, image_format), game.version)
+    finally:
+        with image_refresh_lock:
+            image_refreshes.pop(key, None)
+        cache.delete(f'{key}-refreshing')
+        close_old_connections()
+
+
+def wait_for_votecount_image(slug, image_format):
+    # another process is rendering the first image for this game; raises futures.TimeoutError if it isn't done soon
+    key = votecount_image_key(slug, image_format)
+    deadline = time.time() + settings.VF_IMAGE_WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(0.25)
+        cached_image = cache.get(key)
+        if cached_image is not None:
+            return cached_image
+    raise futures.TimeoutError
+
+
+def draw_votecount_image(game, image_format='png'):
+    return ImageRenderer.image_renderer.render(GameContext.GameContext(game).game_state, image_format)
+
+
+def cache_votecount_image(key, data, version):
+    etag = quote_etag(hashlib.sha1(data).hexdigest())  # noqa: S324
+    # an image that comes out the same as last time keeps its old Last-Modified, so
+    # clients that revalidate by date still get their 304
+    modified_key = f'{key}-modified'
+    last_etag, last_modified = cache.get(modified_key, (None, None))
+    if last_etag != etag:
+        last_modified = int(time.time())
+        cache.set(modified_key, (etag, last_modified), VOTECOUNT_IMAGE_CACHE_SECONDS)
+
+    cached_image = {'data': data, 'etag': etag, 'last_modified': last_modified, 'rendered_at': time.time(),
+                    'version': version}
+    cache.set(key, cached_image, VOTECOUNT_IMAGE_CACHE_SECONDS)
+    return cached_image
+
+
+def autoupdate(request):
+    # one pass over every open game; the autoupdated command does the same job on a per-game schedule
+    renders = []
+    for game in Game.objects.exclude(state='closed').order_by('-last_updated'):
+        game = update_open_game(game)
+        # drawing happens in parallel while the remaining games update
+        render = prerender_votecount_image(game)
+        if render is not None:
+            renders.append((game, render))
+
+    for game, render in renders:
+        store_prerendered_image(game, render)
     return HttpResponse('Ok')
 
 
+def update_open_game(game):
+    # reads any new posts, and closes the game if nobody has posted in six days
+    game = check_update_game(game, catch_up=True)
+    post = game.posts.order_by('-timestamp')[:1][0]
+
+    if datetime.now() - post.timestamp > timedelta(days=6) and game.state == 'started':
+        game.status_update('Closed automatically for inactivity.')
+        game.state = 'closed'
+        game.save()
+        game.archive_post_bodies()
+    return game
+
+
+def prerender_votecount_image(game):
+    # The PNG is by far the most requested, so it's drawn ahead of time if it's out of date; other formats
+    # are redrawn on their next request, since their version no longer matches. Returns the render, if any.
+    cached_image = cache.get(votecount_image_key(game.slug))
+    if cached_image is not None and not votecount_image_is_stale(cached_image, game):
+        return None
+    try:
+        return ImageRenderer.image_renderer.submit(GameContext.GameContext(game).game_state, wait=True)
+    except ImageRenderer.ImageRendererBusy:
+        return None
+
+
+def store_prerendered_image(game, render):
+    try:
+        cache_votecount_image(votecount_image_key(game.slug), render.result(timeout=settings.VF_IMAGE_RENDER_TIMEOUT),
+                              game.version)
+    except Exception:
+        logger.exception(f'Could not draw the votecount image for {game.slug}')
+
+
 def players(request):
     return players_page(request, 1)
 
@@ -1008,6 +1207,7 @@ def delete_alias(request, aliasid):
     messages.add_message(request, messages.SUCCESS, f'The alias <strong>{alias.alias}</strong> was deleted.')
     player = alias.player
     alias.delete()
+    VoteResolver.VoteResolver.invalidate_player(player)
 
     return HttpResponseRedirect(f'/player/{player.slug}')
 
@@ -1070,61 +1270,63 @@ def post_vc(request, gameid):
         # ... but I really should investigate this
         return HttpResponseForbidden
 
-    if game.last_vc_post is not None and datetime.now() - game.last_vc_post < timedelta(minutes=60) and (game.deadline and game.deadline - datetime.now() > timedelta(minutes=60)):
-        messages.add_message(request, messages.ERROR, 'Votefinder has posted too recently in that game.')
-    else:
-        game.last_vc_post = datetime.now()
-        game.save()
+    # holding the lease while posting means two clicks can't both get past the last_vc_post check
+    lease = game.acquire_lease()
+    if lease is None:
+        messages.add_message(request, messages.ERROR, 'Someone else is updating that game right now.  Please try again in a minute.')
+        return redirect(game.get_absolute_url())
+    try:
+        game.refresh_from_db()
+        if game.last_vc_post is not None and datetime.now() - game.last_vc_post < timedelta(minutes=60) and (game.deadline and game.deadline - datetime.now() > timedelta(minutes=60)):
+            messages.add_message(request, messages.ERROR, 'Votefinder has posted too recently in that game.')
+        else:
+            game.last_vc_post = datetime.now()
+            game.save()
 
-        game = check_update_game(game)
+            game = read_new_posts(game, lease)
 
-        vc_formatter = VotecountFormatter.VotecountFormatter(game)
-        vc_formatter.go()
-        if game.home_forum == 'sa':
-            dl = SAForumPageDownloader.SAForumPageDownloader()
-            dl.reply_to_thread(game.thread_id, vc_formatter.get_escaped_bbcode())
-        elif game.home_forum == 'bnr':
-            dl = BNRApi.BNRApi()
-            dl.reply_to_thread(game.thread_id, vc_formatter.get_bbcode())
+            game_context = GameContext.GameContext(game, request)
+            if game.home_forum == 'sa':
+                dl = SAForumPageDownloader.SAForumPageDownloader()
+                dl.reply_to_thread(game.thread_id, game_context.escaped_bbcode)
+            elif game.home_forum == 'bnr':
+                dl = BNRApi.BNRApi()
+                dl.reply_to_thread(game.thread_id, game_context.bbcode)
 
-        messages.add_message(request, messages.SUCCESS, 'Votecount posted.')
+            messages.add_message(request, messages.SUCCESS, 'Votecount posted.')
+    finally:
+        game.release_lease(lease)
 
     return redirect(game.get_absolute_url())
 
 
 def votechart_all(request, gameslug):
     game = get_object_or_404(Game, slug=gameslug)
-    day = GameDay.objects.get(game=game, day_number=game.current_day)
-    required_votes_to_execute = int(math.floor(len(game.living_players()) / 2.0) + 1)
-
-    vc = VoteCounter.VoteCounter()
-    vc.run(game)
-    vote_log = vc.get_votelog()
+    game_context = GameContext.GameContext(game, request)
+    day = game_context.gameday
+    vote_log = game_context.votelog
 
     return render(request, 'votechart.html',
                   {'game': game, 'showAllPlayers': True, 'startDate': day.start_post.timestamp,
-                   'now': datetime.now(), 'toExecute': required_votes_to_execute,
+                   'now': datetime.now(), 'toExecute': game_context.to_execute,
                    'votes': vote_log, 'numVotes': len(vote_log),
-                   'players': [player.player.name for player in game.living_players()],
-                   'allPlayers': [player.player for player in game.living_players()]},
+                   'players': [player.player.name for player in game_context.living_players],
+                   'allPlayers': [player.player for player in game_context.living_players]},
                   )
 
 
 def votechart_player(request, gameslug, playerslug):
     game = get_object_or_404(Game, slug=gameslug)
     player = get_object_or_404(Player, slug=playerslug)
-    day = GameDay.objects.get(game=game, day_number=game.current_day)
-    required_votes_to_execute = int(math.floor(len(game.living_players()) / 2.0) + 1)
-
-    vc = VoteCounter.VoteCounter()
-    vc.run(game)
-    vote_log = [vote for vote in vc.get_votelog() if vote['player'] == player.name]
+    game_context = GameContext.GameContext(game, request)
+    day = game_context.gameday
+    vote_log = [vote for vote in game_context.votelog if vote['player'] == player.name]
 
     return render(request, 'votechart.html',
                   {'game': game, 'showAllPlayers': False, 'startDate': day.start_post.timestamp,
-                   'now': datetime.now(), 'toExecute': required_votes_to_execute,
+                   'now': datetime.now(), 'toExecute': game_context.to_execute,
                    'votes': vote_log, 'numVotes': len(vote_log),
-                   'allPlayers': [player.player for player in game.living_players()],
+                   'allPlayers': [player.player for player in game_context.living_players],
                    'selectedPlayer': player.name,
                    'players': [player.name]},
                   )
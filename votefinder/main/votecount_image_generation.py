@@ -1,11 +1,11 @@
-from django.conf import settings
+import html
+import io
+from functools import lru_cache
 
-from votefinder.main import VotecountFormatter
+from django.conf import settings
 
 from PIL import ImageDraw, ImageFont, Image
 
-regular_font = ImageFont.truetype(settings.VF_REGULAR_FONT_PATH, 15)
-bold_font = ImageFont.truetype(settings.VF_BOLD_FONT_PATH, 15)
 
 # dummy Image/ImageDraw objects to use so we can access
 # ImageDraw.multiline_textbbox before actually creating an image
@@ -14,12 +14,44 @@ bold_font = ImageFont.truetype(settings.VF_BOLD_FONT_PATH, 15)
 dummy_img = Image.new('RGB', (0,0), (255, 255, 255))
 dummy_draw = ImageDraw.Draw(dummy_img)
 
-def votecount_to_image(game):
+# the same gap ImageDraw leaves between lines of multiline text
+LINE_SPACING = 4
+
+# background and text colours for the image modes we draw in
+WHITE = {'RGB': (255, 255, 255), 'L': 255}
+BLACK = {'RGB': (0, 0, 0), 'L': 0}
+
+# SVG votecounts are laid out without measuring any text, using rough character widths
+# (as a fraction of the font size) for a sans-serif font; the viewer's own font does the rest
+SVG_FONT_SIZE = 15
+SVG_LINE_HEIGHT = 19
+SVG_CHAR_WIDTH = 0.52
+SVG_BOLD_CHAR_WIDTH = 0.58
+
+
+@lru_cache(maxsize=1)
+def fonts():
+    # opened on first use rather than when views imports this module
+    return ImageFont.truetype(settings.VF_REGULAR_FONT_PATH, 15), ImageFont.truetype(settings.VF_BOLD_FONT_PATH, 15)
+
+
+@lru_cache(maxsize=8192)
+def text_bbox(text, font):
+    # bounding box of a single line of text; player names and vote lists come up again on
+    # every render, so they are only measured once
+    return dummy_draw.textbbox((0,0), text, font=font)
 
-    # get the gamestate object
-    vc = VotecountFormatter.VotecountFormatter(game)
-    vc.go(show_comment=False)
-    game_state = vc.game_state
+
+@lru_cache(maxsize=8)
+def line_height(font):
+    # distance between the tops of two lines of multiline text, worked out the way ImageDraw does
+    return text_bbox('A', font)[3] + LINE_SPACING
+
+
+def game_state_to_image(game_state, mode='RGB'):
+    # everything below only needs the game_state dict, so it can run away from
+    # the database (see ImageRenderer)
+    regular_font, bold_font = fonts()
 
     # we're going to compose the votecount image out of several smaller
     # images - one for each player, plus one for the game title and one for
@@ -40,10 +72,10 @@ def votecount_to_image(game):
     # going over each of the players who have received votes to generate
     # names/received votes - we need this to determine the maximum width
     # available for the names that come afterwards
-    max_player_name_width = draw_votecount_names(game_state, votecounts)
+    max_player_name_width = draw_votecount_names(game_state, votecounts, mode)
 
     # now we'll generate the actual list of voting players
-    draw_vote_list(game_state, votecounts, max_player_name_width)
+    draw_vote_list(game_state, votecounts, max_player_name_width, mode)
 
     # split the votecounts dictionary into a list of tuples - index 0 of the
     # tuple is the name of the voted player, index 1 is the list of votes
@@ -83,7 +115,7 @@ def votecount_to_image(game):
     # Actual image creation follows
     # the +16s are to create a margin around the image, so the text doesn't
     # butt right up to the edge
-    img = Image.new('RGB', (816, total_height + 16), (255, 255, 255))
+    img = Image.new(mode, (816, total_height + 16), WHITE[mode])
     draw = ImageDraw.Draw(img)
 
     # cursor values to keep track of where we should be drawing on our image
@@ -92,7 +124,7 @@ def votecount_to_image(game):
     cursor_x = 8
     cursor_y = 8
 
-    draw.text((cursor_x, cursor_y), header_text, fill=(0,0,0), font=bold_font)
+    draw.text((cursor_x, cursor_y), header_text, fill=BLACK[mode], font=bold_font)
     cursor_y += header_height + 16
 
     for name, votes in vote_images:
@@ -102,13 +134,97 @@ def votecount_to_image(game):
         cursor_y += votes.height
 
     cursor_y += 16
-    draw.text((cursor_x, cursor_y), footer_text, fill=(0,0,0), font=bold_font)
+    draw.text((cursor_x, cursor_y), footer_text, fill=BLACK[mode], font=bold_font)
 
     return img
 
+def game_state_to_png(game_state):
+    # the finished PNG file, ready to be cached and served as-is
+    buffer = io.BytesIO()
+    game_state_to_image(game_state).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def game_state_to_palette_png(game_state):
+    # drawn in greyscale and cut down to four shades, which is all black text on
+    # white needs; the PNG comes out with 2 bits a pixel
+    img = game_state_to_image(game_state, 'L').point(lambda value: (value + 42) // 85 * 85)
+    buffer = io.BytesIO()
+    img.quantize(colors=4).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def game_state_to_svg(game_state):
+    # the same layout as the PNG, as SVG text - no drawing, and no measuring either
+    rows = [x for x in game_state['votecounts_by_player'] if x['votes_received'] != 0]
+    labels = [f'{votecount["player_name"]} ({votecount["votes_received"]}): ' for votecount in rows]
+    max_player_name_width = max((svg_text_width(label, True) for label in labels), default=0)
+    max_width = 800 - max_player_name_width
+
+    cursor_x = 8
+    cursor_y = 8
+    elements = [svg_text(cursor_x, cursor_y, f"Votecount for Day {game_state['gameday']}", bold=True)]
+    cursor_y += SVG_LINE_HEIGHT + 16
+
+    for label, votecount in zip(labels, rows):
+        elements.append(svg_text(cursor_x + max_player_name_width, cursor_y, label, bold=True, anchor='end'))
+        for line in wrap_svg_text(active_voters(votecount), max_width):
+            elements.append(svg_text(cursor_x + max_player_name_width, cursor_y, line))
+            cursor_y += SVG_LINE_HEIGHT
+        cursor_y += 4
+
+    cursor_y += 16
+    elements.append(svg_text(cursor_x, cursor_y, f"With {game_state['players']} alive, it's {game_state['to_execute']} votes to execute.", bold=True))
+    if game_state['deadline'] != '':
+        cursor_y += SVG_LINE_HEIGHT
+        elements.append(svg_text(cursor_x, cursor_y, f"The current deadline is {game_state['deadline']} - that's in about {game_state['until_deadline']}.", bold=True))
+    height = cursor_y + SVG_LINE_HEIGHT + 8
+
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="816" height="{height}" viewBox="0 0 816 {height}" '
+            f'font-family="Myriad Pro, Helvetica, Arial, sans-serif" font-size="{SVG_FONT_SIZE}">'
+            f'<rect width="816" height="{height}" fill="#fff"/>{"".join(elements)}</svg>')
+
+def svg_text(x, top, text, bold=False, anchor=None):
+    # y is the baseline in SVG, so drop the text by (roughly) its ascent
+    attributes = f' x="{x:g}" y="{top + SVG_FONT_SIZE - 2:g}"'
+    if bold:
+        attributes += ' font-weight="bold"'
+    if anchor:
+        attributes += f' text-anchor="{anchor}"'
+    return f'<text{attributes} xml:space="preserve">{html.escape(text)}</text>'
+
+def svg_text_width(text, bold=False):
+    return len(text) * SVG_FONT_SIZE * (SVG_BOLD_CHAR_WIDTH if bold else SVG_CHAR_WIDTH)
+
+def wrap_svg_text(player_names, max_width):
+    lines = [player_names[0]]
+    for p in player_names[1:]:
+        if svg_text_width(f'{lines[-1]}, {p}') > max_width:
+            lines[-1] += ','
+            lines.append(p)
+        else:
+            lines[-1] += f', {p}'
+    return lines
+
+# output formats for votecounts: what draws them, and their content type
+IMAGE_FORMATS = {
+    'png': (game_state_to_png, 'image/png'),
+    'palette': (game_state_to_palette_png, 'image/png'),
+    'svg': (lambda game_state: game_state_to_svg(game_state).encode(), 'image/svg+xml'),
+}
+
+def render_game_state(game_state, image_format='png'):
+    return IMAGE_FORMATS[image_format][0](game_state)
+
+def active_voters(votecount):
+    # the names shown against a player: everyone whose vote on them still stands
+    return [
+        n['author'] for n in votecount['votes'] if
+        n['enabled'] == True and n['unvote'] == False
+    ]
+
 # generates images of the player name plus their received votes, plus
 # returns widest player name, for generation of the vote list image
-def draw_votecount_names(game_state, votecounts):
+def draw_votecount_names(game_state, votecounts, mode='RGB'):
+    bold_font = fonts()[1]
     
     # going to store the widest player name plus votes received so far so we
     # can use it later when building other elements
@@ -118,10 +234,10 @@ def draw_votecount_names(game_state, votecounts):
 
         # figure maximum width of generated text and create image for it
         text = f'{votecount["player_name"]} ({votecount["votes_received"]}): '
-        _, _, right, bottom = dummy_draw.textbbox((0,0), text=text, font=bold_font)
-        img = Image.new('RGB', (right, bottom), (255, 255, 255))
+        _, _, right, bottom = text_bbox(text, bold_font)
+        img = Image.new(mode, (right, bottom), WHITE[mode])
         draw = ImageDraw.Draw(img)
-        draw.text((0,0), text=text, font=bold_font, fill=(0,0,0))
+        draw.text((0,0), text=text, font=bold_font, fill=BLACK[mode])
 
         votecounts[votecount['player_name']] = [img, None]        
 
@@ -129,48 +245,45 @@ def draw_votecount_names(game_state, votecounts):
 
     return max_player_name_width
 
-def draw_vote_list(game_state, votecounts, max_player_name_width):
+def draw_vote_list(game_state, votecounts, max_player_name_width, mode='RGB'):
+    regular_font = fonts()[0]
     max_width = 800 - max_player_name_width
 
     for votecount in [x for x in game_state['votecounts_by_player'] if x['votes_received'] != 0]:
 
-        player_names = [
-            n['author'] for n in votecount['votes'] if
-            n['enabled'] == True and n['unvote'] == False
-        ]
-
-        player_names_text = player_names[0]
-
-        _, _, _, text_height = dummy_draw.multiline_textbbox(
-                (0,0),
-                player_names[0],
-                font=regular_font
-            )
+        player_names = active_voters(votecount)
 
-        # we start iteration at 1 because we've already figured the bounding
-        # box with the first player name present
+        # Each name goes on the end of the current line unless that would make the text wider
+        # than max_width, in which case it starts a new line. Only the line being added to is
+        # measured; the finished lines' widest point and lowest point are carried along, which
+        # together give the same bounding box ImageDraw works out for the whole text.
+        lines = [player_names[0]]
+        text_height = text_bbox(player_names[0], regular_font)[3]
+        finished_right = 0
+        finished_bottom = 0
         for p in player_names[1:len(player_names)]:
-            _, _, right, bottom = dummy_draw.multiline_textbbox(
-                (0,0),
-                player_names_text + f', {p}',
-                font=regular_font
-            )
-            if right > max_width:
-                text_height += bottom
-                player_names_text += f',\n{p}'
+            line_top = (len(lines) - 1) * line_height(regular_font)
+            _, _, right, bottom = text_bbox(lines[-1] + f', {p}', regular_font)
+            if max(finished_right, right) > max_width:
+                text_height += max(finished_bottom, line_top + bottom)
+                lines[-1] += ','
+                _, _, right, bottom = text_bbox(lines[-1], regular_font)
+                finished_right = max(finished_right, right)
+                finished_bottom = max(finished_bottom, line_top + bottom)
+                lines.append(p)
             else:
-                player_names_text += f', {p}'
-            
-            
+                lines[-1] += f', {p}'
+
+        player_names_text = '\n'.join(lines)
 
         # the + 4 to text height is to insure things like the tails of 
         # characters like 'g' don't accidentally get cropped
-        votes_image = Image.new('RGB', (max_width, text_height + 4), (255, 255, 255))
+        votes_image = Image.new(mode, (max_width, text_height + 4), WHITE[mode])
         votes_draw = ImageDraw.Draw(votes_image)
         votes_draw.multiline_text(
                 (0,0),
                 player_names_text,
-                fill=(0, 0, 0),
+                fill=BLACK[mode],
                 font=regular_font
             )
 
@@ -67,6 +67,47 @@ VF_SA_DISCORD_CHANNEL = env_string('VF_SA_DISCORD_CHANNEL')
 # Bread n' Roses forum integration
 VF_BNR_API_KEY = env_string('VF_BNR_API_KEY')
 
+# The autoupdater catches games up by downloading the missing pages of a thread concurrently. This is the size of
+# the download pool, and the most pages a single catch-up will read before handing back to the caller.
+VF_CATCHUP_WORKERS = env_integer('VF_CATCHUP_WORKERS', default=4)
+VF_CATCHUP_MAX_PAGES = env_integer('VF_CATCHUP_MAX_PAGES', default=50)
+
+# How SA thread pages are parsed: 'streaming' parses just the posts, one at a time, and is several times faster;
+# 'html5lib' parses the whole page as a browser would, for any page the streaming reader can't make sense of.
+VF_SA_PAGE_PARSER = env_string('VF_SA_PAGE_PARSER', default='streaming')
+
+# When set, every forum page that's read is also kept, compressed, under this directory, so games can be rebuilt
+# later with the replay_archived_pages command without downloading them again. Off when unset.
+VF_PAGE_ARCHIVE_DIR = env_string('VF_PAGE_ARCHIVE_DIR')
+
+# Votecount images are always served from the cache. Once an image is older than this many seconds the next
+# request starts a background refresh of the game and its image; the pool size caps how many refresh at once.
+VF_IMAGE_REFRESH_SECONDS = env_integer('VF_IMAGE_REFRESH_SECONDS', default=120)
+VF_IMAGE_REFRESH_WORKERS = env_integer('VF_IMAGE_REFRESH_WORKERS', default=2)
+VF_IMAGE_REFRESH_TIMEOUT = env_integer('VF_IMAGE_REFRESH_TIMEOUT', default=60)
+# A request for an image that hasn't been drawn yet waits at most this many seconds for it before getting a 503.
+VF_IMAGE_WAIT_SECONDS = env_integer('VF_IMAGE_WAIT_SECONDS', default=5)
+
+# Votecount images are drawn in a pool of this many worker processes (0 draws them in the web worker itself).
+# At most VF_IMAGE_RENDER_QUEUE more renders can wait for a free worker, and a render taking longer than
+# VF_IMAGE_RENDER_TIMEOUT seconds is given up on.
+VF_IMAGE_RENDER_WORKERS = env_integer('VF_IMAGE_RENDER_WORKERS', default=2)
+VF_IMAGE_RENDER_QUEUE = env_integer('VF_IMAGE_RENDER_QUEUE', default=8)
+VF_IMAGE_RENDER_TIMEOUT = env_integer('VF_IMAGE_RENDER_TIMEOUT', default=10)
+# The python interpreter the render workers are started with. Defaults to the one running votefinder; under uwsgi
+# that's uwsgi itself, so set this (to the virtualenv's bin/python) or images are drawn in the web worker instead.
+VF_IMAGE_RENDER_PYTHON = env_string('VF_IMAGE_RENDER_PYTHON')
+
+# The autoupdated command checks each open game again after a tenth of the time since its last post, but never
+# more often than VF_AUTOUPDATE_MIN_SECONDS or less often than VF_AUTOUPDATE_MAX_SECONDS, using this many workers.
+VF_AUTOUPDATE_WORKERS = env_integer('VF_AUTOUPDATE_WORKERS', default=4)
+VF_AUTOUPDATE_MIN_SECONDS = env_integer('VF_AUTOUPDATE_MIN_SECONDS', default=60)
+VF_AUTOUPDATE_MAX_SECONDS = env_integer('VF_AUTOUPDATE_MAX_SECONDS', default=30 * 60)
+# Copies of autoupdated share out the games through leases that last this many seconds unless renewed, and
+# claim at most VF_AUTOUPDATE_BATCH_SIZE more games per sweep.
+VF_AUTOUPDATE_LEASE_SECONDS = env_integer('VF_AUTOUPDATE_LEASE_SECONDS', default=120)
+VF_AUTOUPDATE_BATCH_SIZE = env_integer('VF_AUTOUPDATE_BATCH_SIZE', default=25)
+
 # Fonts used in vote image generation
 VF_REGULAR_FONT_PATH = 'votefinder/main/static/votefinder/MyriadPro-Regular.otf'
 VF_BOLD_FONT_PATH = 'votefinder/main/static/votefinder/MyriadPro-Bold.otf'
@@ -192,6 +233,9 @@ PASSWORD_HASHERS = [
 ]
 
 MIDDLEWARE = (
+    # compression has to wrap everything that reads or writes the response body
+    'django.middleware.gzip.GZipMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',